@@ -1,11 +1,19 @@
 import os
 import cv2
+import logging
 import numpy as np
 from PIL import Image
 import json
+import shutil
+import tempfile
 from pathlib import Path
 
-from paddleocr import PaddleOCR, draw_ocr
+from paddleocr import draw_ocr
+from ocr_pool import get_ocr_pool, OCR_BATCH_SIZE, OCR_ENGINE_KWARGS
+from metrics import span, timed
+
+logger = logging.getLogger(__name__)
+
 # https://github.com/PaddlePaddle/PaddleOCR.git
 
   
@@ -29,6 +37,32 @@ def extract_red_box(image_path, output_dir='temp_ocr/red_box'):
     if image is None:
         raise ValueError(f"Could not read image from {image_path}")
     
+    warped = find_red_box(image)
+    
+    # Create output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # Get the filename from the path
+    filename = Path(image_path).stem
+    output_path = os.path.join(output_dir, f"{filename}_red_box.jpg")
+    
+    # Save the warped image
+    cv2.imwrite(output_path, warped)
+    
+    print(f"Box extracted and saved to {output_path}")
+    return output_path, warped
+
+@timed("red_box_extraction")
+def find_red_box(image):
+    """
+    Detect and straighten the red/orange box in an image held in memory.
+    
+    Args:
+        image: BGR image (numpy array)
+        
+    Returns:
+        The extracted and straightened red box image
+    """
     # Create a copy of original image
     orig_image = image.copy()
     
@@ -168,19 +202,7 @@ def extract_red_box(image_path, output_dir='temp_ocr/red_box'):
             # Perform perspective transform
             matrix = cv2.getPerspectiveTransform(corners.astype(np.float32), dst_points)
             warped = cv2.warpPerspective(orig_image, matrix, (width, height))
-            
-            # Create output directory if it doesn't exist
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # Get the filename from the path
-            filename = Path(image_path).stem
-            output_path = os.path.join(output_dir, f"{filename}_red_box.jpg")
-            
-            # Save the warped image
-            cv2.imwrite(output_path, warped)
-            
-            print(f"Box extracted and saved to {output_path}")
-            return output_path, warped
+            return warped
     
     # If all detection methods fail, use a fallback method - detect the largest rectangular area
     print("All detection methods failed, using fallback method...")
@@ -232,19 +254,8 @@ def extract_red_box(image_path, output_dir='temp_ocr/red_box'):
                     # Perform perspective transform
                     matrix = cv2.getPerspectiveTransform(corners.astype(np.float32), dst_points)
                     warped = cv2.warpPerspective(orig_image, matrix, (width, height))
-                    
-                    # Create output directory if it doesn't exist
-                    os.makedirs(output_dir, exist_ok=True)
-                    
-                    # Get the filename from the path
-                    filename = Path(image_path).stem
-                    output_path = os.path.join(output_dir, f"{filename}_red_box.jpg")
-                    
-                    # Save the warped image
-                    cv2.imwrite(output_path, warped)
-                    
-                    print(f"Box extracted with fallback method and saved to {output_path}")
-                    return output_path, warped
+                    print("Box extracted with fallback method")
+                    return warped
     
     raise ValueError("Could not detect a box in the image using any method")
 
@@ -293,32 +304,45 @@ def process_image(img_path, output_base="temp_ocr"):
     if image is None:
         raise ValueError(f"Could not read image from {img_path}")
     
+    output_files = []
+    
+    # Save each line WITHOUT any margin
+    for i, line_img in enumerate(split_into_lines(image)):
+        filename = f"line_{i+1}.jpg"
+        output_path = os.path.join(output_base, filename)
+        cv2.imwrite(output_path, line_img)
+        output_files.append(output_path)
+    
+    return output_files
+
+@timed("line_splitting")
+def split_into_lines(image, num_lines=30):
+    """
+    Divide an in-memory image into EXACTLY EQUAL horizontal lines.
+    
+    Args:
+        image: BGR image (numpy array)
+        num_lines: Number of lines to split into
+        
+    Returns:
+        list: Line images (views into the input image)
+    """
     # Get image dimensions
     height, width = image.shape[:2]
     
     # Calculate EXACT line height - use float division first, then round
     # We want all rows to be IDENTICAL in height
-    exact_line_height = height / 30
+    exact_line_height = height / num_lines
     
-    output_files = []
-    
-    # Process each line
-    for i in range(30):
+    lines = []
+    for i in range(num_lines):
         # Calculate line boundaries using floating point and then convert to int
         # This ensures the cuts are as equal as possible
         y_start = int(i * exact_line_height)
         y_end = int((i + 1) * exact_line_height)
-        
-        # Extract the line
-        line_img = image[y_start:y_end, 0:width].copy()
-        
-        # Save line WITHOUT any margin
-        filename = f"line_{i+1}.jpg"
-        output_path = os.path.join(output_base, filename)
-        cv2.imwrite(output_path, line_img)
-        output_files.append(output_path)
+        lines.append(image[y_start:y_end, 0:width])
     
-    return output_files
+    return lines
 
 def remove_images_without_enough_black_pixels(folder_path="temp_ocr", black_threshold=50, min_black_pixel_count=10):
     """
@@ -361,15 +385,7 @@ def remove_images_without_enough_black_pixels(folder_path="temp_ocr", black_thre
             print(f"Could not read {img_path}, skipping.")
             continue
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Count pixels darker than the threshold
-        # Create a binary image where black pixels become white (255) and others become black (0)
-        _, binary = cv2.threshold(gray, black_threshold, 255, cv2.THRESH_BINARY_INV)
-        
-        # Count the white pixels in the binary image (which were the dark pixels in the original)
-        black_pixel_count = cv2.countNonZero(binary)
+        black_pixel_count = count_black_pixels(image, black_threshold)
         
         # If there are fewer black pixels than the minimum, remove the image
         if black_pixel_count < min_black_pixel_count:
@@ -381,6 +397,78 @@ def remove_images_without_enough_black_pixels(folder_path="temp_ocr", black_thre
     print(f"Checked {total_count} images, removed {removed_count} images with fewer than {min_black_pixel_count} black pixels.")
     return 
 
+def count_black_pixels(image, black_threshold=50):
+    """
+    Count pixels darker than the threshold in a BGR image.
+    
+    Args:
+        image: BGR image (numpy array)
+        black_threshold: Pixel intensity threshold (0-255) below which pixels are considered "black"
+        
+    Returns:
+        int: Number of black pixels
+    """
+    # Convert to grayscale
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    
+    # Count pixels darker than the threshold
+    # Create a binary image where black pixels become white (255) and others become black (0)
+    _, binary = cv2.threshold(gray, black_threshold, 255, cv2.THRESH_BINARY_INV)
+    
+    # Count the white pixels in the binary image (which were the dark pixels in the original)
+    return cv2.countNonZero(binary)
+
+def crop_to_black_content(image, black_threshold=70, margin_size=7, padding=10):
+    """
+    Crop an in-memory image from its leftmost to rightmost black pixel,
+    adding padding on the sides and white margins on top and bottom.
+    
+    Args:
+        image: BGR image (numpy array)
+        black_threshold: Threshold for detecting black pixels (0-255)
+        margin_size: Size of top/bottom margin to add to output images
+        padding: Extra padding to include on either side of black content
+        
+    Returns:
+        Tuple of (cropped image, left_crop, right_crop), or None if no black pixels were found
+    """
+    # Get original dimensions
+    height, width = image.shape[:2]
+    
+    # Convert to grayscale
+    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    
+    # Apply threshold to create binary image
+    _, binary_image = cv2.threshold(gray_image, black_threshold, 255, cv2.THRESH_BINARY_INV)
+    
+    # Columns containing at least one black pixel
+    black_columns = np.flatnonzero(binary_image.any(axis=0))
+    
+    # If no black pixels found, skip further processing
+    if black_columns.size == 0:
+        return None
+    
+    leftmost_black = black_columns[0]
+    rightmost_black = black_columns[-1]
+    
+    # Calculate crop boundaries with added padding
+    left_crop = max(leftmost_black - padding, 0)
+    right_crop = min(rightmost_black + padding, width)
+    
+    # Crop the image horizontally
+    cropped = image[:, left_crop:right_crop]
+    
+    # Add top and bottom margins
+    cropped_height, cropped_width = cropped.shape[:2]
+    
+    # Create new white image with margins
+    result = np.full((cropped_height + 2 * margin_size, cropped_width, 3), 255, dtype=np.uint8)
+    
+    # Place the cropped image in the center with margins
+    result[margin_size:margin_size + cropped_height, :] = cropped
+    
+    return result, left_crop, right_crop
+
 def crop_images_to_black_content(folder_path="temp_ocr", black_threshold=70, margin_size=7, padding=10):
     """
     Processes images in a folder by cropping from leftmost to rightmost black pixel.
@@ -422,41 +510,11 @@ def crop_images_to_black_content(folder_path="temp_ocr", black_threshold=70, mar
                 print(f"Could not read {img_path}, skipping.")
                 continue
             
-            # Get original dimensions
-            height, width = image.shape[:2]
-            
-            # Convert to grayscale
-            gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # Apply threshold to create binary image
-            _, binary_image = cv2.threshold(gray_image, black_threshold, 255, cv2.THRESH_BINARY_INV)
-            
-            # Find coordinates of black pixels (non-zero in binary image)
-            non_zero_coords = np.column_stack(np.where(binary_image > 0))
+            cropped = crop_to_black_content(image, black_threshold, margin_size, padding)
             
             # If no black pixels found, skip further processing
-            if non_zero_coords.size > 0:
-                # Get column coordinates (x-coordinates) of black pixels
-                # In np.where [0] is rows (y) and [1] is columns (x)
-                # Here we need to look at [1] indices for horizontal (x) coordinates
-                leftmost_black = non_zero_coords[:, 1].min()
-                rightmost_black = non_zero_coords[:, 1].max()
-                
-                # Calculate crop boundaries with added padding
-                left_crop = max(leftmost_black - padding, 0)
-                right_crop = min(rightmost_black + padding, width)
-                
-                # Crop the image horizontally
-                cropped = image[:, left_crop:right_crop]
-                
-                # Add top and bottom margins
-                cropped_height, cropped_width = cropped.shape[:2]
-                
-                # Create new white image with margins
-                result = np.ones((cropped_height + 2 * margin_size, cropped_width, 3), dtype=np.uint8) * 255
-                
-                # Place the cropped image in the center with margins
-                result[margin_size:margin_size + cropped_height, :] = cropped
+            if cropped is not None:
+                result, left_crop, right_crop = cropped
                 
                 # Save the resulting image, overwriting the original
                 cv2.imwrite(str(img_path), result)
@@ -664,7 +722,7 @@ def parse(data):
     
     return result
  
-def perform_ocr(img_path, font_path=None, output_dir='sample_output'):
+def perform_ocr(img_path, font_path=None, output_dir='sample_output', engine=None):
     """
     Perform OCR on an image and save visualization of results.
     
@@ -672,6 +730,7 @@ def perform_ocr(img_path, font_path=None, output_dir='sample_output'):
         img_path: Path to the input image
         font_path: Path to font for visualization (optional)
         output_dir: Directory to save visualization output
+        engine: PaddleOCR engine to use (optional, checked out from the pool if omitted)
         
     Returns:
         List of OCR text results
@@ -681,25 +740,14 @@ def perform_ocr(img_path, font_path=None, output_dir='sample_output'):
         print(f"Warning: Image not found: {img_path}")
         return []
         
-    # Initialize OCR
+    # Run OCR with a pooled engine (checked out here only if the caller did not pass one)
     try:
-        ocr = PaddleOCR(
-            lang='en',
-            use_angle_cls=True,          # Detect text at different angles
-            rec_algorithm='SVTR_LCNet',  # More advanced recognition algorithm
-            det_algorithm='DB',          # Enhanced detection algorithm
-            det_db_thresh=0.2,           # Lower threshold for better detection of faint text
-            det_db_box_thresh=0.25,      # Lower box threshold for detecting unclear boundaries
-            det_db_unclip_ratio=2.0,     # Higher ratio to better group characters in handwriting
-            use_dilation=True,           # Help connect broken character strokes
-            use_gpu=True,                # Use GPU if available for better performance
-            enable_mkldnn=True,          # Enable Intel acceleration if available
-            rec_batch_num=6,             # Increased batch size for recognition
-            max_batch_size=12,           # Higher batch size for processing
-            drop_score=0.4,              # Lower confidence threshold to catch more potential text
-            det_limit_side_len=960       # Higher resolution limit for better detail capture
-        )
-        result = ocr.ocr(img_path, cls=False)
+        if engine is None:
+            with get_ocr_pool().engine() as pooled_engine, span("ocr_recognition"):
+                result = pooled_engine.ocr(img_path, cls=False)
+        else:
+            with span("ocr_recognition"):
+                result = engine.ocr(img_path, cls=False)
     except Exception as e:
         print(f"OCR error for {img_path}: {e}")
         return []
@@ -731,6 +779,82 @@ def perform_ocr(img_path, font_path=None, output_dir='sample_output'):
 
     return txts
 
+def perform_ocr_batch(images, engine=None, batch_size=OCR_BATCH_SIZE,
+                      drop_score=OCR_ENGINE_KWARGS['drop_score']):
+    """
+    Recognize text on many line crops at once, skipping text detection.
+    
+    The line crops are already trimmed to their black content, so the
+    recognizer can run on them directly and in batches instead of running
+    detection + recognition separately for every line.
+    
+    Args:
+        images: List of BGR line images (numpy arrays)
+        engine: PaddleOCR engine to use (optional, checked out from the pool if omitted)
+        batch_size: Number of crops per recognition call
+        drop_score: Minimum confidence for a result to be kept
+        
+    Returns:
+        List with one list of OCR text results per input image
+    """
+    if not images:
+        return []
+
+    def recognize(ocr_engine):
+        texts_per_image = []
+        for start in range(0, len(images), batch_size):
+            chunk = images[start:start + batch_size]
+            try:
+                with span("ocr_recognition"):
+                    result = ocr_engine.ocr(chunk, det=False, cls=False)
+                rec_res = result[0] if result else []
+            except Exception as e:
+                print(f"OCR batch error for lines {start + 1}-{start + len(chunk)}: {e}")
+                rec_res = []
+            for i in range(len(chunk)):
+                if i >= len(rec_res) or not rec_res[i]:
+                    texts_per_image.append([])
+                    continue
+                text, score = rec_res[i]
+                if score < drop_score:
+                    texts_per_image.append([])
+                    continue
+                # Detection used to split a line into separate text boxes; split
+                # on whitespace so parse() sees the same kind of items
+                texts_per_image.append(text.split())
+        return texts_per_image
+
+    if engine is None:
+        with get_ocr_pool().engine() as pooled_engine:
+            return recognize(pooled_engine)
+    return recognize(engine)
+
+def perform_ocr_array(image, engine=None):
+    """
+    Perform OCR (detection + recognition) on an in-memory image.
+    
+    Args:
+        image: BGR image (numpy array)
+        engine: PaddleOCR engine to use (optional, checked out from the pool if omitted)
+        
+    Returns:
+        List of OCR text results
+    """
+    try:
+        if engine is None:
+            with get_ocr_pool().engine() as pooled_engine, span("ocr_recognition"):
+                result = pooled_engine.ocr(image, cls=False)
+        else:
+            with span("ocr_recognition"):
+                result = engine.ocr(image, cls=False)
+    except Exception as e:
+        print(f"OCR error: {e}")
+        return []
+
+    if not result or not result[0]:
+        return []
+    return [line[1][0] for line in result[0]]
+
 def parse_and_merge(arr):
     """
     Parse and merge processed OCR data, including the first array.
@@ -757,56 +881,143 @@ def parse_and_merge(arr):
     
     return None, text
 
-def ocr_pipeline(image_path, output_base=None, temp_dir=None):
+def ocr_pipeline(image_path, output_base=None, temp_dir=None, batched=True, batch_size=OCR_BATCH_SIZE):
     """
     Complete OCR pipeline: extract red box, process into lines, and perform OCR.
     
+    Every intermediate file is written inside a workspace that belongs to this
+    call only, so concurrent requests never see each other's line images.
+    
     Args:
         image_path: Path to the input image
-        output_base: Base directory for output files
-        temp_dir: Directory for temporary files
+        output_base: Workspace directory for this request (created under temp_dir if omitted)
+        temp_dir: Parent directory for the per-request workspace (default: "temp_ocr")
+        batched: Recognize all line crops in one batched pass (no per-line detection)
+        batch_size: Number of line crops per recognition call in batched mode
         
     Returns:
         Dictionary of OCR results by file
+
+    Raises:
+        Exception: whatever failed while extracting the box or recognizing the
+        lines; a workspace created by this call is removed either way
     """
-    # Set default output directory
-    if output_base is None:
-        output_base = f'temp_ocr/{Path(image_path).stem}'
+    # Set default (unique) workspace; one created here is also removed here
+    created_workspace = output_base is None
+    if created_workspace:
+        parent_dir = temp_dir if temp_dir else 'temp_ocr'
+        os.makedirs(parent_dir, exist_ok=True)
+        output_base = tempfile.mkdtemp(prefix=f'{Path(image_path).stem}_', dir=parent_dir)
+    
+    red_box_dir = os.path.join(output_base, 'red_box')
+    lines_dir = os.path.join(output_base, 'lines')
     
     all_texts = {}
     
     try:
         # Extract and straighten the red box
-        input_processed_files, red_box_img = extract_red_box(image_path)
+        input_processed_files, red_box_img = extract_red_box(image_path, red_box_dir)
         
         # Process the extracted red box into lines
-        processed_files = process_image(input_processed_files, output_base)
+        processed_files = process_image(input_processed_files, lines_dir)
 
         # Remove unused image 
-        remove_images_without_enough_black_pixels()
-        crop_images_to_black_content()
-        # enhance_images_for_paddleocr()
+        remove_images_without_enough_black_pixels(lines_dir)
+        crop_images_to_black_content(lines_dir)
+        # enhance_images_for_paddleocr(lines_dir)
         
         # Perform OCR on each line
         all_texts = {}
-        temp_ocr_folder = "temp_ocr"
         image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']
         image_files = []
         for ext in image_extensions:
-            image_files.extend(Path(temp_ocr_folder).glob(f"*{ext}"))
+            image_files.extend(Path(lines_dir).glob(f"*{ext}"))
 
-        for file_path in image_files:
-            try:
-                file_path_str = str(file_path)
-                texts = perform_ocr(file_path_str)
-                all_texts[file_path_str] = convert_char(texts)
-            except Exception as e:
-                print(f"Error: {e}")
-    except Exception as e:
-            print(f"Error: {e}")
+        # One engine serves every line of this request
+        with get_ocr_pool().engine() as engine:
+            if batched:
+                line_files = []
+                line_images = []
+                for file_path in image_files:
+                    img = cv2.imread(str(file_path))
+                    if img is not None:
+                        line_files.append(str(file_path))
+                        line_images.append(img)
+                batch_texts = perform_ocr_batch(line_images, engine=engine, batch_size=batch_size)
+                for file_path_str, texts in zip(line_files, batch_texts):
+                    all_texts[file_path_str] = convert_char(texts)
+            else:
+                for file_path in image_files:
+                    file_path_str = str(file_path)
+                    texts = perform_ocr(file_path_str, engine=engine)
+                    all_texts[file_path_str] = convert_char(texts)
+    except Exception:
+        logger.exception("OCR pipeline failed for %s", image_path)
+        raise
+    finally:
+        if created_workspace:
+            shutil.rmtree(output_base, ignore_errors=True)
     return all_texts
                 
 
+def ocr_pipeline_array(image, batched=True, batch_size=OCR_BATCH_SIZE,
+                       black_threshold=50, min_black_pixel_count=10):
+    """
+    In-memory OCR pipeline: extract red box, split into lines, drop empty
+    lines, crop to content and perform OCR without touching the filesystem.
+    
+    Args:
+        image: BGR image (numpy array)
+        batched: Recognize all line crops in one batched pass (no per-line detection)
+        batch_size: Number of line crops per recognition call in batched mode
+        black_threshold: Threshold used to decide whether a line has content
+        min_black_pixel_count: Minimum number of black pixels for a line to be kept
+        
+    Returns:
+        Dictionary of OCR results by line name, in line order
+
+    Raises:
+        Exception: whatever failed while extracting the box or recognizing the
+        lines, so callers can tell a failure from an empty result
+    """
+    all_texts = {}
+    
+    try:
+        # Extract and straighten the red box
+        red_box_img = find_red_box(image)
+        
+        # Split into lines, keep lines with enough ink and crop them to it
+        line_names = []
+        line_images = []
+        for i, line_img in enumerate(split_into_lines(red_box_img)):
+            if count_black_pixels(line_img, black_threshold) < min_black_pixel_count:
+                continue
+            cropped = crop_to_black_content(line_img)
+            if cropped is None:
+                continue
+            line_names.append(f"line_{i+1}")
+            line_images.append(cropped[0])
+        
+        # One engine serves every line of this request
+        with get_ocr_pool().engine() as engine:
+            if batched:
+                batch_texts = perform_ocr_batch(line_images, engine=engine, batch_size=batch_size)
+            else:
+                batch_texts = [perform_ocr_array(line_img, engine=engine) for line_img in line_images]
+        
+        for name, texts in zip(line_names, batch_texts):
+            all_texts[name] = convert_char(texts)
+    except Exception:
+        logger.exception("In-memory OCR pipeline failed")
+        raise
+    return all_texts
+
+def results_to_dict(arr):
+    """
+    Number OCR results the way they are returned to clients ({"1": ..., "2": ...}).
+    """
+    return {str(i + 1): value for i, value in enumerate(arr)}
+
 def write_to_json(arr, filename='result.json'):
     """
     Write OCR results to a JSON file.
@@ -820,7 +1031,7 @@ def write_to_json(arr, filename='result.json'):
     """
     try:
         # Create numbered dictionary from array
-        data = {str(i + 1): value for i, value in enumerate(arr)}
+        data = results_to_dict(arr)
         
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
@@ -4,76 +4,93 @@ import uuid
 import logging
 import matplotlib
 matplotlib.use('Agg')
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g, Response
 # Import the fragmentation functions from your module
-from frag import fragmentation_to_outline
-from ocr import OCR
-from kuzram import kuz_ram_model
+from frag import fragmentation_to_outline, red_outline_analysis, InvalidImageError
+from ocr import OCR, OCR_from_array
+from kuzram import kuz_ram_model, kuz_ram_batch
 from io import BytesIO
 import uuid
 import cv2
 import numpy as np
 import time
 import shutil  
+import threading
 # Import the marker extraction functions
 from object_detector import extract_marker_properties
 import io
 import base64
-from final import compute_kuz_ram_data, extract_and_save_cutouts, combined_plot
-from matplotlib import pyplot as plt
-import requests
-
-def run_full_fragmentation_analysis(image_path: str, A: float, K: float, Q: float, E: float, n: float, conversion: float):
+from final import compute_kuz_ram_data, extract_and_save_cutouts, combined_plot, SIEVE_WEIGHTINGS
+from sieve import SieveCurve
+from plotting import render_combined_plot, plot_series, clamp_dpi, PLOT_FORMATS, DEFAULT_PLOT_DPI
+from uploader import get_uploader, read_upload_status
+from model_registry import warm_up as warm_up_sam, registry_stats
+from ocr_pool import get_ocr_pool
+from result_cache import get_result_cache, content_hash, make_key
+from fragment_measurement import measure_fragments
+from jobs import (get_job_manager, peek_job_manager, read_job_status, read_job_result, QueueFullError,
+                  WorkerPoolError)
+from mask_profiles import resolve_profile, UnknownProfileError
+from sam_onnx import warm_up as warm_up_onnx
+import metrics
+
+def run_full_fragmentation_analysis(image_path: str, A: float, K: float, Q: float, E: float, n: float, conversion: float,
+                                    render_cutouts: bool = False, sieve_series=None, weighting: str = "count",
+                                    async_upload: bool = False, plot_format: str = "png",
+                                    plot_dpi: int = DEFAULT_PLOT_DPI, image_hash: str = None):
     # Compute the Kuz-Ram data.
     kuzram_data = compute_kuz_ram_data(A, K, Q, E, n)
     
-    # Create a unique output folder for cutouts.
-    unique_output = os.path.join(os.getcwd(), f"bw-cutout_{uuid.uuid4()}")
-    os.makedirs(unique_output, exist_ok=True)
-    
-    # Call extract_and_save_cutouts with the unique output directory.
-    _, _, longest_sides_pixels, threshold_percentages = extract_and_save_cutouts(image_path, conversion, output_dir=unique_output)
-    
-    # === Generate the combined plot ===
-    plt.figure(figsize=(10, 8))
-    sizes = kuzram_data["sizes"]
-    distribution = kuzram_data["distribution"]
-    plt.plot(sizes, distribution, label=f"Kuz-Ram Distribution\nX50 = {kuzram_data['X50']:.2f} cm", linestyle='-', color='blue')
-    
-    if kuzram_data["P10"] is not None:
-        plt.axvline(kuzram_data["P10"], color='green', linestyle='--', label=f'P10 = {kuzram_data["P10"]:.2f} cm')
-    if kuzram_data["P20"] is not None:
-        plt.axvline(kuzram_data["P20"], color='cyan', linestyle='--', label=f'P20 = {kuzram_data["P20"]:.2f} cm')
-    if kuzram_data["P80"] is not None:
-        plt.axvline(kuzram_data["P80"], color='purple', linestyle='--', label=f'P80 = {kuzram_data["P80"]:.2f} cm')
-    if kuzram_data["P90"] is not None:
-        plt.axvline(kuzram_data["P90"], color='orange', linestyle='--', label=f'P90 = {kuzram_data["P90"]:.2f} cm')
-    plt.axvline(kuzram_data["X50"], color='magenta', linestyle='-.', label=f'X50 = {kuzram_data["X50"]:.2f} cm')
-    
-    if len(longest_sides_pixels) > 1:
-        measurements_cm = [m * conversion for m in longest_sides_pixels[1:]]
-        sorted_meas = np.sort(measurements_cm)
-        n_points = len(sorted_meas)
-        cumulative_percentage = np.arange(1, n_points + 1) / n_points * 100
-        plt.plot(sorted_meas, cumulative_percentage, marker='o', linestyle='-', label="CDF of Object Sizes", color='red')
+    # Cutout/annotation artifacts are only rendered when explicitly requested;
+    # the analysis itself needs just the measurements.
+    unique_output = None
+    if render_cutouts:
+        unique_output = os.path.join(os.getcwd(), f"bw-cutout_{uuid.uuid4()}")
+        os.makedirs(unique_output, exist_ok=True)
     
-    plt.xlabel("Size (cm)")
-    plt.ylabel("Cumulative Percentage (%)")
-    plt.title("Combined Kuz-Ram Distribution and CDF")
-    plt.grid(True)
-    plt.legend(loc='best')
+    # Measurements depend only on the image, so changing A/K/Q/E/n or the
+    # conversion factor on a re-upload reuses them from the cache.
+    fragments = None
+    image = None
+    measurements_cache = get_result_cache().tier("measurements")
+    measurements_key = make_key(image_hash, "fragments") if image_hash else None
+    if measurements_key:
+        fragments = measurements_cache.get(measurements_key)
+    if fragments is None:
+        with metrics.span("upload_decode"):
+            image = cv2.imread(image_path)
+        if image is None:
+            raise ValueError("Image not found. Check the file path.")
+        fragments = measure_fragments(image)
+        if measurements_key:
+            measurements_cache.put(measurements_key, fragments)
     
-    # Save the plot to a buffer.
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format="png", dpi=300)
-    plt.close()
-    buffer.seek(0)
-    upload_resp = requests.post(
-        "http://localhost:5180/api/Upload/upload",
-        files={"file": ("plot.png", buffer, "image/png")}
+    _, _, longest_sides_pixels, threshold_percentages = extract_and_save_cutouts(
+        image_path, conversion, output_dir=unique_output, render_cutouts=render_cutouts,
+        sieve_series=sieve_series, weighting=weighting, fragments=fragments, image=image
     )
-    upload_resp.raise_for_status()
-    plot_url = upload_resp.json()["url"]
+    size_percentiles = SieveCurve(np.asarray(longest_sides_pixels) * conversion).percentiles((10, 50, 80))
+    
+    # === Generate the combined plot ===
+    # "series" skips rasterization entirely and lets the client draw the chart
+    plot_url = None
+    plot_upload = None
+    series = None
+    if plot_format == "series":
+        series = plot_series(kuzram_data, longest_sides_pixels, conversion)
+    else:
+        plot_bytes = render_combined_plot(kuzram_data, longest_sides_pixels, conversion,
+                                          fmt=plot_format, dpi=plot_dpi)
+        extension, content_type = PLOT_FORMATS[plot_format]
+        
+        # Upload over the shared keep-alive session; in async mode the client
+        # polls /plots/<id> for the URL instead of waiting for it here.
+        uploader = get_uploader()
+        if async_upload:
+            upload_id = uploader.upload_async(plot_bytes, f"plot.{extension}", content_type)
+            plot_upload = {"id": upload_id, "status": "pending", "status_url": f"/plots/{upload_id}"}
+        else:
+            plot_url = uploader.upload(plot_bytes, f"plot.{extension}", content_type)
     
     # Delete only the unique output folder (bw-cutout_{uuid}) after processing.
     # shutil.rmtree(unique_output, ignore_errors=True)
@@ -92,11 +109,87 @@ def run_full_fragmentation_analysis(image_path: str, A: float, K: float, Q: floa
             "percentage_above_60": kuzram_data["percentage_above_60"]
         },
         "threshold_percentages": threshold_percentages,
-        "plot_image_base64": plot_url
+        "size_percentiles": size_percentiles,
+        "plot_image_base64": plot_url,
+        "plot_upload": plot_upload,
+        "plot_series": series
     }
 
 app = Flask(__name__)
 
+# "sync" waits for the plot URL; "async" returns a pending reference (per-request override: plot_upload form field)
+PLOT_UPLOAD_MODE = os.environ.get("PLOT_UPLOAD_MODE", "sync")
+
+# Set once the models are loaded; /ready reports 503 until then
+models_ready = threading.Event()
+
+def warm_up_models():
+    """
+    Load this process's models before the first request arrives. serve.py calls
+    it in each worker after forking, never before: the libraries' thread pools
+    do not survive a fork.
+    """
+    warm_up_onnx(warm_up_sam())
+    get_ocr_pool().warm_up()
+    models_ready.set()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Label by route pattern, not the raw path, so job ids do not create new series
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.inc("http_requests_total", endpoint=endpoint, method=request.method, status=response.status_code)
+    start = g.get("request_start")
+    if start is not None:
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - start, endpoint=endpoint)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Prometheus text format: per-stage latency histograms, request counts and
+    durations, requests waiting for or holding a serve.py concurrency slot (the
+    request queue) and 503 rejections, plus the job queue and OCR pool occupancy
+    of this process. Set METRICS_DIR to aggregate the series of all workers.
+    """
+    pid = {"pid": os.getpid()}
+    pool = get_ocr_pool().stats()
+    gauges = {
+        "ocr_pool_engines_in_use": ("OCR engines checked out.", [(pid, pool["in_use"])]),
+        "ocr_pool_engines_idle": ("OCR engines waiting in the pool.", [(pid, pool["idle"])]),
+    }
+    # Only report the job queue once it exists; starting it here would spawn workers
+    manager = peek_job_manager()
+    if manager is not None:
+        jobs = manager.stats()
+        gauges["job_queue_depth"] = ("Jobs waiting for a free worker.", [(pid, jobs["queued"])])
+        gauges["jobs_active"] = ("Jobs queued or running.", [(pid, jobs["active"])])
+    body = metrics.render_prometheus(metrics.collect_snapshots(), gauges)
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Liveness: the process is up and answering requests."""
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness: only healthy once SAM and the OCR engines are loaded."""
+    if not models_ready.is_set():
+        return jsonify({"ready": False, "pid": os.getpid()}), 503
+    return jsonify({"ready": True, "pid": os.getpid()})
+
+@app.route('/models/stats', methods=['GET'])
+def models_stats():
+    return jsonify({"sam": registry_stats(), "ocr_pool": get_ocr_pool().stats()})
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(get_result_cache().stats())
+
 @app.route('/ocr', methods=['POST'])
 def ocr_endpoint():
     if 'file' not in request.files:
@@ -107,36 +200,32 @@ def ocr_endpoint():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
-    unique_id = str(uuid.uuid4())
-    temp_filename = f"temp_image_{unique_id}.jpg"
-    unique_id = str(uuid.uuid4())
-    temp_filename = f"temp_image_{unique_id}.jpg"
-    file.save(temp_filename)
-
-    temp_folder = "temp_ocr"
-    output_folder = "output_ocr"
-
-    try:
-        OCR(temp_filename, temp_folder, output_folder)
-    except Exception as e:
-        os.remove(temp_filename)
-        return jsonify({"error": "Error processing OCR"}), 500
+    # Decode the upload in memory; the whole pipeline runs without temp files
+    raw_bytes = file.read()
+    image_hash = content_hash(raw_bytes)
+    with metrics.span("upload_decode"):
+        file_bytes = np.frombuffer(raw_bytes, np.uint8)
+        image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+    if image is None:
+        return jsonify({'error': 'Invalid image file'}), 400
 
-    base_name = os.path.splitext(os.path.basename(temp_filename))[0]
-    result_json_path = os.path.join(output_folder, f'res_{base_name}.json')
+    ocr_cache = get_result_cache().tier("ocr")
+    ocr_key = make_key(image_hash, "ocr")
+    ocr_data = ocr_cache.get(ocr_key)
+    if ocr_data is None:
+        try:
+            ocr_data = OCR_from_array(image)
+        except Exception as e:
+            return jsonify({"error": "Error processing OCR"}), 500
+        if ocr_data is not None:
+            ocr_cache.put(ocr_key, ocr_data)
 
-    if not os.path.exists(result_json_path):
-        os.remove(temp_filename)
+    if ocr_data is None:
         return jsonify({'error': 'No OCR result found'}), 500
 
-    with open(result_json_path, 'r') as f:
-        ocr_data = json.load(f)
-
     response = {
         'ocr_result': ocr_data
     }
-    os.remove(temp_filename)
-    os.remove(result_json_path)
 
     return jsonify(response)
 
@@ -164,66 +253,72 @@ def fragmentation_red_outline():
       - output_image: the segmentation result image encoded as a base64 string.
       - marker_properties: a dict containing the marker filename,
                            the longest side in pixels, and the conversion factor.
+      - profile: the mask generator profile used.
+    
+    Optional form field "profile" selects a speed/quality profile
+    ("preview", "standard" or "survey"; see mask_profiles).
     """
     file = request.files.get("file")
     if not file or file.filename == "":
         return jsonify({"error": "No file uploaded"}), 400
 
     try:
-        # Generate a unique ID
-        uid = str(uuid.uuid4())
-        # Read the image from the request
-        file_bytes = np.frombuffer(file.read(), np.uint8)
-        image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-        if image is None:
-            return jsonify({"error": "Invalid image file"}), 400
-
-        # Save the input image temporarily
-        input_filename = f"in_memory_input_{uid}.jpg"
-        cv2.imwrite(input_filename, image)
-
-        # Create a unique output folder
-        output_folder = f"output_frag/output_frag_red_outline_{uid}"
+        profile = resolve_profile(request.form.get("profile"))
+        response = red_outline_analysis(file.read(), profile=profile)
+        return jsonify(response)
 
-        # Call fragmentation_to_outline, which processes the image, saves segmentation result
-        # and cutouts; it returns the processed segmentation image.
-        output_image = fragmentation_to_outline(input_filename, output_folder)
+    except (InvalidImageError, UnknownProfileError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Fragmentation failed: {str(e)}"}), 500
 
-        # Clean up the temporary input file
-        if os.path.exists(input_filename):
-            os.remove(input_filename)
+@app.route('/jobs/fragmentation-red-outline', methods=['POST'])
+def submit_fragmentation_red_outline_job():
+    """
+    Asynchronous variant of /fragmentation-red-outline: returns 202 with a job id
+    right away. Poll /jobs/<job_id> for progress and fetch /jobs/<job_id>/result.
+    Responds 503 when the job queue is full or the job workers are restarting.
+    """
+    file = request.files.get("file")
+    if not file or file.filename == "":
+        return jsonify({"error": "No file uploaded"}), 400
 
-        # Determine the image name (based on the input file)
-        image_name = os.path.splitext(os.path.basename(input_filename))[0]
-        # Calculate the cutouts folder path generated by the segmentation process
-        cutouts_folder = os.path.join(output_folder, f"cutouts_{image_name}")
-        print(cutouts_folder)
-        
-        # Call extract_marker_properties on the cutouts folder to get the marker info
-        _,_,conversion_factor = extract_marker_properties(cutouts_folder)
-        marker_data = {
-            "conversion_factor": conversion_factor
-        }
-
-        # Save the marker extraction info as JSON in the cutouts folder
-        marker_properties_path = os.path.join(cutouts_folder, "marker_properties.json")
-        with open(marker_properties_path, "w") as f:
-            json.dump(marker_data, f)
-
-        # Encode the output segmentation image as JPEG and then base64
-        ret, buffer = cv2.imencode('.jpg', output_image)
-        if not ret:
-            return jsonify({"error": "Failed to encode output image"}), 500
-        encoded_image = base64.b64encode(buffer).decode('utf-8')
-
-        response = {
-            "output_image": encoded_image,
-            "marker_properties": marker_data
-        }
-
-        # shutil.rmtree(output_folder, ignore_errors=True)
-        return jsonify(response)
+    try:
+        profile = resolve_profile(request.form.get("profile"))
+    except UnknownProfileError as e:
+        return jsonify({"error": str(e)}), 400
 
+    try:
+        job_id = get_job_manager().submit("fragmentation-red-outline", red_outline_analysis, file.read(),
+                                          profile=profile)
+    except (QueueFullError, WorkerPoolError) as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "30"}
+
+    return jsonify({
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result"
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    # Answered from the shared state store: the job may belong to another worker
+    status = read_job_status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    status = read_job_status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if status["state"] in ("queued", "running"):
+        return jsonify(status), 202
+    try:
+        return jsonify(read_job_result(job_id))
+    except InvalidImageError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Fragmentation failed: {str(e)}"}), 500
 
@@ -238,21 +333,51 @@ def fragmentation_analysis():
 
     try:
         # Get parameters from form-data
-        A = float(request.form.get("A"))
-        K = float(request.form.get("K"))
-        Q = float(request.form.get("Q"))
-        E = float(request.form.get("E"))
-        n = float(request.form.get("n"))
-        conversion = float(request.form.get("conversion"))  # mm/px
+        try:
+            A = float(request.form.get("A"))
+            K = float(request.form.get("K"))
+            Q = float(request.form.get("Q"))
+            E = float(request.form.get("E"))
+            n = float(request.form.get("n"))
+            conversion = float(request.form.get("conversion"))  # mm/px
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid or missing parameters"}), 400
+        params_error = _kuzram_params_error({"A": A, "K": K, "Q": Q, "E": E, "n": n, "conversion": conversion})
+        if params_error:
+            return jsonify({"error": params_error}), 400
+        render_cutouts = request.form.get("render_cutouts", "false").lower() in ("1", "true", "yes")
+        # Optional custom sieve series, e.g. "500,250,125,63"
+        sieve_sizes = request.form.get("sieve_sizes")
+        try:
+            sieve_series = [float(v) for v in sieve_sizes.split(",") if v.strip()] if sieve_sizes else None
+        except ValueError:
+            return jsonify({"error": f"Invalid sieve_sizes: {sieve_sizes}"}), 400
+        weighting = request.form.get("weighting", "count")
+        if weighting not in SIEVE_WEIGHTINGS:
+            return jsonify({"error": f"Unsupported weighting: {weighting}, expected one of: "
+                                     f"{', '.join(SIEVE_WEIGHTINGS)}"}), 400
+        async_upload = request.form.get("plot_upload", PLOT_UPLOAD_MODE).lower() == "async"
+        # "png" (default), "svg" or "series" (raw data, no image)
+        plot_format = request.form.get("plot_format", "png").lower()
+        if plot_format != "series" and plot_format not in PLOT_FORMATS:
+            return jsonify({"error": f"Unsupported plot_format: {plot_format}"}), 400
+        try:
+            plot_dpi = clamp_dpi(request.form.get("plot_dpi", DEFAULT_PLOT_DPI))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
         # Save image temporarily
+        raw_bytes = file.read()
         uid = str(uuid.uuid4())
         temp_filename = f"fragment_{uid}.jpg"
-        file.save(temp_filename)
+        with open(temp_filename, "wb") as f:
+            f.write(raw_bytes)
 
         # Perform full analysis
         result = run_full_fragmentation_analysis(
-            temp_filename, A, K, Q, E, n, conversion
+            temp_filename, A, K, Q, E, n, conversion, render_cutouts=render_cutouts,
+            sieve_series=sieve_series, weighting=weighting, async_upload=async_upload,
+            plot_format=plot_format, plot_dpi=plot_dpi, image_hash=content_hash(raw_bytes)
         )
 
         os.remove(temp_filename)
@@ -261,6 +386,24 @@ def fragmentation_analysis():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+@app.route('/plots/<upload_id>', methods=['GET'])
+def plot_upload_status(upload_id):
+    state = read_upload_status(upload_id)
+    if state is None:
+        return jsonify({"error": "Unknown plot upload"}), 404
+    return jsonify(state)
+
+def _kuzram_params_error(params):
+    """
+    Error message naming the checked parameters when any of them is not a
+    positive, finite number (scalars or arrays), else None.
+    """
+    # Zero or negative inputs turn X50, Xc and the percentiles into NaN/inf,
+    # which is not valid JSON
+    if all(np.all(np.isfinite(v) & (np.asarray(v) > 0)) for v in params.values()):
+        return None
+    return f"Kuz-Ram parameters ({', '.join(params)}) must be positive, finite numbers"
+
 @app.route('/kuzram', methods=['POST'])
 def kuzram_endpoint():
     data = request.get_json()
@@ -274,9 +417,50 @@ def kuzram_endpoint():
         n = float(data["n"])
     except (KeyError, ValueError) as e:
         return jsonify({"error": "Invalid or missing parameters"}), 400
+    params_error = _kuzram_params_error({"A": A, "K": K, "Q": Q, "E": E, "n": n})
+    if params_error:
+        return jsonify({"error": params_error}), 400
 
     result = kuz_ram_model(A, K, Q, E, n)
     return jsonify(result)
 
+# Upper bound on design variants per /kuzram/batch call
+KUZRAM_BATCH_MAX = 100000
+
+@app.route('/kuzram/batch', methods=['POST'])
+def kuzram_batch_endpoint():
+    """
+    Evaluate many blast designs at once. Each of A, K, Q, E, n may be a number
+    or a list; lists must have equal length (numbers are broadcast).
+    Optional "percentiles" (list of passing percentages) and "cutoff".
+    The response is columnar: one list per output, aligned by design index.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "No JSON payload provided"}), 400
+    try:
+        params = [np.asarray(data[name], dtype=np.float64) for name in ("A", "K", "Q", "E", "n")]
+        percentiles = [float(p) for p in data.get("percentiles", [10, 20, 50, 80, 90])]
+        cutoff = float(data.get("cutoff", 60))
+        # Raises ValueError when list lengths do not match
+        shape = np.broadcast_shapes(*(p.shape for p in params))
+    except (KeyError, ValueError, TypeError) as e:
+        return jsonify({"error": "Invalid or missing parameters"}), 400
+    count = int(np.prod(shape))
+    if len(shape) > 1 or not all(0 < pct < 100 for pct in percentiles):
+        return jsonify({"error": "Invalid or missing parameters"}), 400
+    if count > KUZRAM_BATCH_MAX:
+        return jsonify({"error": f"At most {KUZRAM_BATCH_MAX} designs per batch"}), 400
+    params_error = _kuzram_params_error(dict(zip(("A", "K", "Q", "E", "n", "cutoff"), params + [cutoff])))
+    if params_error:
+        return jsonify({"error": params_error}), 400
+
+    result = kuz_ram_batch(*params, percentiles=percentiles, cutoff=cutoff)
+    columns = {key: np.atleast_1d(values).tolist() for key, values in result.items()}
+    return jsonify({"count": count, "columns": columns})
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    # Prefork server, models loaded per worker (see serve.py for the SERVE_* settings);
+    # for local debugging use `flask --app app run --debug` instead
+    from serve import run
+    run(app, warm_up_models)
@@ -0,0 +1,193 @@
+"""
+Compare SAM backends for /fragmentation-red-outline on reference images.
+
+Each backend runs in a fresh process so its peak memory is measured in isolation.
+Masks are compared against the first backend (vit_h by default): for every
+reference mask the best-matching mask's IoU is taken, and the mean over all
+reference masks is reported as mask mIoU.
+
+Usage:
+    python benchmark_sam.py input_frag/1.jpeg input_frag/2.jpeg \\
+        --backends vit_h,vit_l,vit_b,vit_b:int8,vit_h:onnx --profile standard --output sam_report.json
+
+Backends are written as <model_type>[:int8|:onnx]; ":onnx" runs the exported
+encoder/decoder with ONNX Runtime instead of eager torch. Checkpoints are looked
+up in model_registry.SAM_CHECKPOINTS unless --checkpoint-dir is given.
+"""
+import os
+import json
+import time
+import argparse
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from mask_codec import compact_masks, overlap_area
+
+
+def parse_backend(spec):
+    """'vit_b:int8' -> {"model_type": "vit_b", "quantize": "int8", "runtime": "torch"}"""
+    parts = spec.strip().split(":")
+    backend = {"model_type": parts[0], "quantize": "none", "runtime": "torch"}
+    for option in parts[1:]:
+        if option == "int8":
+            backend["quantize"] = "int8"
+        elif option == "onnx":
+            backend["runtime"] = "onnx"
+        else:
+            raise ValueError(f"Unknown backend option '{option}' in '{spec}'")
+    if backend["quantize"] != "none" and backend["runtime"] == "onnx":
+        raise ValueError(f"'{spec}': the ONNX runtime exports the fp32 model")
+    return backend
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _run_backend(spec, image_paths, profile, repeats, checkpoint_dir):
+    """Executed in a fresh process: load one backend and segment every image."""
+    import torch
+    from segment_anything import SamAutomaticMaskGenerator
+    from model_registry import get_sam_model, SAM_CHECKPOINTS
+    from mask_profiles import generator_settings, postprocess_masks
+
+    backend = parse_backend(spec)
+    checkpoint = SAM_CHECKPOINTS[backend["model_type"]]
+    if checkpoint_dir:
+        checkpoint = os.path.join(checkpoint_dir, checkpoint)
+
+    start = time.perf_counter()
+    sam = get_sam_model(backend["model_type"], checkpoint, "cpu", backend["quantize"])
+    load_seconds = time.perf_counter() - start
+    # A plain generator: the embedding cache would hide the encoder cost on repeats
+    generator = SamAutomaticMaskGenerator(sam, output_mode="uncompressed_rle", **generator_settings(profile))
+    if backend["runtime"] == "onnx":
+        from result_cache import ByteLRUCache
+        from sam_onnx import OnnxSamPredictor, get_onnx_sessions
+        model_name = os.path.splitext(os.path.basename(checkpoint))[0]
+        start = time.perf_counter()
+        sessions = get_onnx_sessions(sam, model_name)
+        load_seconds += time.perf_counter() - start
+        # A zero-byte cache never stores, so every image runs the encoder
+        generator.predictor = OnnxSamPredictor(sam, sessions, (backend["model_type"], model_name),
+                                               cache=ByteLRUCache("benchmark", 0))
+
+    results = []
+    for path in image_paths:
+        image = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            with torch.inference_mode():
+                masks = postprocess_masks(compact_masks(generator.generate(image)), profile, generator)
+            latencies.append(time.perf_counter() - start)
+        results.append({
+            "image": path,
+            "latency_seconds": float(np.median(latencies)),
+            "masks": [ann["segmentation"] for ann in masks],
+        })
+    return {
+        "backend": spec,
+        "load_seconds": load_seconds,
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "images": results,
+    }
+
+
+def mask_miou(reference, candidate):
+    """
+    Mean over reference masks of the best IoU with any candidate mask, or None
+    when the reference has no masks (there is nothing to compare against).
+    """
+    if not reference:
+        return None
+    if not candidate:
+        return 0.0
+    boxes = np.array([m.bbox for m in candidate], dtype=np.int64)
+    cx0, cy0 = boxes[:, 0], boxes[:, 1]
+    cx1, cy1 = cx0 + boxes[:, 2], cy0 + boxes[:, 3]
+    areas = [m.area for m in candidate]
+    scores = []
+    for ref in reference:
+        x, y, w, h = ref.bbox
+        hit = np.flatnonzero((cx0 < x + w) & (x < cx1) & (cy0 < y + h) & (y < cy1))
+        ref_area = ref.area
+        best = 0.0
+        for index in hit:
+            inter = overlap_area(ref, candidate[index])
+            if inter:
+                best = max(best, inter / (ref_area + areas[index] - inter))
+        scores.append(best)
+    return float(np.mean(scores))
+
+
+def run_benchmark(image_paths, backends, profile="standard", repeats=1, checkpoint_dir=None):
+    """
+    Run every backend on every image and compare masks with the first backend.
+
+    Returns:
+        List of per-backend summaries (latency, load time, peak memory, mask mIoU)
+    """
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for spec in backends:
+        print(f"Benchmarking {spec} ...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            runs.append(executor.submit(_run_backend, spec, image_paths, profile, repeats,
+                                        checkpoint_dir).result())
+
+    reference = runs[0]
+    report = []
+    for run in runs:
+        # Images without reference masks carry no quality signal
+        ious = [iou for iou in (mask_miou(ref["masks"], cand["masks"])
+                                for ref, cand in zip(reference["images"], run["images"])) if iou is not None]
+        latencies = [image["latency_seconds"] for image in run["images"]]
+        report.append({
+            "backend": run["backend"],
+            "reference": reference["backend"],
+            "load_seconds": round(run["load_seconds"], 3),
+            "mean_latency_seconds": round(float(np.mean(latencies)), 3),
+            "peak_rss_mb": round(run["peak_rss_bytes"] / 2 ** 20, 1),
+            "mean_masks": round(float(np.mean([len(image["masks"]) for image in run["images"]])), 1),
+            "mask_miou": round(float(np.mean(ious)), 4) if ious else None,
+        })
+    return report
+
+
+def format_report(report):
+    """Markdown table of a run_benchmark report."""
+    lines = [
+        "| backend | load (s) | latency / image (s) | peak RSS (MB) | masks / image | mIoU vs "
+        f"{report[0]['reference']} |",
+        "|---|---|---|---|---|---|",
+    ]
+    for row in report:
+        miou = "N/A" if row["mask_miou"] is None else row["mask_miou"]
+        lines.append(f"| {row['backend']} | {row['load_seconds']} | {row['mean_latency_seconds']} | "
+                     f"{row['peak_rss_mb']} | {row['mean_masks']} | {miou} |")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("images", nargs="+", help="Reference images")
+    parser.add_argument("--backends", default="vit_h,vit_l,vit_b,vit_b:int8,vit_h:onnx",
+                        help="Comma-separated backends; the first one is the IoU reference")
+    parser.add_argument("--profile", default="standard", help="Mask generator profile")
+    parser.add_argument("--repeats", type=int, default=1, help="Runs per image (median latency is kept)")
+    parser.add_argument("--checkpoint-dir", default=None, help="Directory holding the checkpoints")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.images, args.backends.split(","), args.profile, args.repeats, args.checkpoint_dir)
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved report to {args.output}")
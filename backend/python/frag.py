@@ -1,30 +1,95 @@
 from frag_helper import SegmentAnythingPipeline
+from object_detector import extract_marker_properties_from_masks
+from result_cache import get_result_cache, content_hash, make_key
+from metrics import span
 import os 
+import base64
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 
-def fragmentation_to_outline(input_path, output_dir="output_frag"):
+def fragmentation_to_outline(input_path, output_dir="output_frag", image_hash=None, progress=None):
     """
     Process an image to identify and outline fragmented objects.
     
     Args:
         input_path: Path to the input image file
         output_path: Path where the output image with outlines will be saved
+        image_hash: Content hash of the input, used to reuse cached masks
+        progress: Optional callback(stage, **info) for stage-level progress
     """
     pipeline = SegmentAnythingPipeline()
-    # Call process_image, which returns the full path to the result
-    result_path = pipeline.process_image(input_path, output_dir)
+    # process_image returns the rendered composite directly, no JPEG round trip
+    composite = pipeline.process_image(input_path, output_dir, image_hash=image_hash, progress=progress,
+                                       save_result=False)
+    if composite is None:
+        raise ValueError("Failed to produce the segmentation result image.")
     
-    # Read the saved output image back into a NumPy array
-    output_image = cv2.imread(result_path, cv2.IMREAD_COLOR)
-    if output_image is None:
-        raise ValueError("Failed to load the segmentation result image.")
+    # Callers expect a 3-channel BGR image
+    return cv2.cvtColor(composite, cv2.COLOR_GRAY2BGR)
+
+class InvalidImageError(ValueError):
+    """Raised when an uploaded file cannot be decoded as an image."""
+
+def red_outline_analysis(raw_bytes, progress=None, profile=None):
+    """
+    Full /fragmentation-red-outline processing of an uploaded image: segmentation
+    outline plus marker-based conversion factor.
     
-    # Optionally, remove the file if you don't need to keep it on disk
-    # os.remove(result_path)
+    Everything stays in memory: the decoded upload is segmented directly and the
+    marker is found on its masks, so no input copy, result JPEG or cutout folder
+    is written.
     
-    return output_image
+    Args:
+        raw_bytes: Encoded image bytes as uploaded
+        progress: Optional callback(stage, **info) for stage-level progress
+        profile: Mask generator profile name (see mask_profiles); None for the default
+        
+    Returns:
+        dict with "output_image" (base64 JPEG) and "marker_properties"
+    """
+    report = progress if progress else (lambda stage, **info: None)
+    
+    image_hash = content_hash(raw_bytes)
+    # Read the image from the request
+    with span("upload_decode"):
+        file_bytes = np.frombuffer(raw_bytes, np.uint8)
+        image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+    if image is None:
+        raise InvalidImageError("Invalid image file")
+    report("image_decoded", width=image.shape[1], height=image.shape[0])
+
+    # Segment the decoded image and render the outline composite
+    pipeline = SegmentAnythingPipeline(profile=profile)
+    masks = pipeline.segment(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), image_hash=image_hash, progress=progress)
+    output_image = pipeline.render_segmentation(image.shape, masks)
+    report("segmentation_rendered")
+    
+    # Find the green marker among the masks to get the conversion factor
+    marker_cache = get_result_cache().tier("marker")
+    # Keyed on the masks' cache key: the marker depends on the segmentation settings
+    marker_key = make_key(pipeline.masks_cache_key(image_hash), "marker")
+    conversion_factor = marker_cache.get(marker_key)
+    if conversion_factor is None:
+        with span("marker_detection"):
+            _,_,conversion_factor = extract_marker_properties_from_masks(image, masks)
+        marker_cache.put(marker_key, conversion_factor)
+    marker_data = {
+        "conversion_factor": conversion_factor
+    }
+    report("marker_found", conversion_factor=conversion_factor)
+
+    # Encode the output segmentation image as JPEG and then base64
+    ret, buffer = cv2.imencode('.jpg', output_image)
+    if not ret:
+        raise RuntimeError("Failed to encode output image")
+    encoded_image = base64.b64encode(buffer).decode('utf-8')
+
+    return {
+        "output_image": encoded_image,
+        "marker_properties": marker_data,
+        "profile": pipeline.profile
+    }
 
 # def fragmentation_to_blackwhite(input_path, output_path=None, line_thickness=3):
 #     """
@@ -1,77 +1,223 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import torch
 import cv2
-from segment_anything import sam_model_registry, SamAutomaticMaskGenerator
+from model_registry import get_sam_model, default_device, sam_backend
+from result_cache import get_result_cache, make_key
+from mask_codec import compact_masks
+from mask_profiles import get_mask_generator, postprocess_masks, resolve_profile
+from metrics import span
+from sam_embeddings import CachedEmbeddingPredictor
+from sam_onnx import OnnxSamPredictor, get_onnx_sessions, onnx_model_name, resolve_runtime
+from sam_tiling import (SAM_MAX_SIDE, SAM_TILE_SIZE, SAM_TILE_OVERLAP, check_tiling, downscale, generate_tiled,
+                        rescale_annotations)
+
+# Threads encoding cutout PNGs (cv2.imwrite releases the GIL)
+CUTOUT_WORKERS = int(os.environ.get("CUTOUT_WORKERS", min(8, os.cpu_count() or 1)))
+
+
+class LazyCutouts:
+    """
+    Per-object cutouts of a segmented image, materialized only on demand.
+
+    Objects are ordered by area, largest first, which is also the numbering of the
+    cutout_<name>_<i>.png files. Each cutout only touches its mask's bounding box:
+    the crop is sliced from the image and the pixels outside the mask are set to white.
+    """
+
+    def __init__(self, image, masks, image_name):
+        self.image = image  # RGB
+        self.image_name = image_name
+        self.masks = sorted((ann for ann in masks if ann['segmentation'].mask.size),
+                            key=lambda ann: ann['area'], reverse=True)
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __getitem__(self, index):
+        object_mask = self.masks[index]['segmentation']
+        cropped_image = self.image[object_mask.slices].copy()
+        cropped_image[~object_mask.mask] = 255  # Set non-mask areas to white
+        return cropped_image
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def filename(self, index):
+        return f"cutout_{self.image_name}_{index + 1}.png"
+
+    def _write_one(self, index, output_dir):
+        output_filename = os.path.join(output_dir, self.filename(index))
+        cv2.imwrite(output_filename, cv2.cvtColor(self[index], cv2.COLOR_RGB2BGR))
+        return output_filename
+
+    def write(self, output_dir, max_workers=CUTOUT_WORKERS):
+        """
+        Crop and encode every cutout as PNG into output_dir, in parallel.
+
+        Returns:
+            List of written file paths, in cutout order
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        with span("cutout_writing"), ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            paths = list(executor.map(lambda index: self._write_one(index, output_dir), range(len(self))))
+        print(f"Saved {len(paths)} cutouts to {output_dir}")
+        return paths
 
 class SegmentAnythingPipeline:
-    def __init__(self, model_type="vit_h", checkpoint_path="sam_vit_h_4b8939.pth", device=None):
-        self.model_type = model_type
-        self.checkpoint_path = checkpoint_path
-        self.device = device if device else ("cuda" if torch.cuda.is_available() else "cpu")
+    def __init__(self, model_type=None, checkpoint_path=None, device=None, quantize=None, runtime=None,
+                 max_side=SAM_MAX_SIDE, tile_size=SAM_TILE_SIZE, tile_overlap=SAM_TILE_OVERLAP, profile=None):
+        # Backend defaults come from SAM_MODEL_TYPE / SAM_CHECKPOINT / SAM_QUANTIZE / SAM_RUNTIME
+        self.model_type, self.checkpoint_path, self.quantize = sam_backend(model_type, checkpoint_path, quantize)
+        self.runtime = resolve_runtime(runtime)
+        if self.runtime == "onnx" and self.quantize != "none":
+            raise ValueError("The ONNX runtime exports the fp32 model; set SAM_QUANTIZE=none")
+        self.device = device if device else default_device()
+        # Mask generator settings (see mask_profiles.MASK_PROFILES)
+        self.profile = resolve_profile(profile)
+        # Inference mode: downscale to max_side, then tile when still larger than tile_size
+        check_tiling(tile_size, tile_overlap)
+        self.max_side = max_side
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
         self.sam = self.load_model()
 
     def load_model(self):
-        model = sam_model_registry[self.model_type](checkpoint=self.checkpoint_path)
-        model.to(device=self.device)
-        return model
+        # Shared per process; only the first pipeline pays the checkpoint load
+        return get_sam_model(self.model_type, self.checkpoint_path, self.device, self.quantize)
+
+    def _generate(self, image):
+        # The generator is shared per profile; each mask is kept only as its
+        # bounding-box crop (see mask_codec)
+        mask_generator, lock = get_mask_generator(self.sam, self.profile, self.model_key(), self.runtime)
+        with lock, span("sam_generate"):
+            masks = mask_generator.generate(image)
+        return postprocess_masks(compact_masks(masks), self.profile, mask_generator)
 
     def generate_masks(self, image):
-        mask_generator = SamAutomaticMaskGenerator(self.sam)
-        masks = mask_generator.generate(image)
+        """
+        Generate masks at the configured working resolution (optionally tiled) and
+        return them in the original image's pixel coordinates.
+        """
+        height, width = image.shape[:2]
+        work = downscale(image, self.max_side)
+        if self.tile_size and max(work.shape[:2]) > self.tile_size:
+            masks = generate_tiled(self._generate, work, self.tile_size, self.tile_overlap)
+        else:
+            masks = self._generate(work)
+        if work is not image:
+            print(f"Segmented at {work.shape[1]}x{work.shape[0]}, rescaling masks to {width}x{height}")
+            masks = rescale_annotations(masks, image.shape)
         return masks
 
         
 
-    def save_segmentation_result(self, image, masks, output_path):
-        # Create a black background image with white regions and black outlines
-        height, width = image.shape[:2]
+    def render_segmentation(self, image_shape, masks):
+        """
+        Render the outline composite: white fragments with black boundaries on black.
+
+        Masks are painted once into an integer label image (later masks win where
+        they overlap); fill and boundaries are then derived from it in bulk, so the
+        cost no longer grows with mask count times image size.
+
+        Args:
+            image_shape: Shape of the source image; only (height, width) is used
+            masks: SAM annotations whose 'segmentation' is a CroppedMask
+
+        Returns:
+            uint8 composite of shape (height, width)
+        """
+        height, width = image_shape[:2]
+        dtype = np.uint16 if len(masks) < np.iinfo(np.uint16).max else np.int32
+        labels = np.zeros((height, width), dtype=dtype)
+        for label, mask in enumerate(masks, start=1):
+            seg = mask['segmentation']
+            labels[seg.slices][seg.mask] = label
+
+        # A labelled pixel is on a boundary when a 4-neighbour carries another label;
+        # the zero padding makes the image edge count as background
+        padded = np.pad(labels, 1)
+        center = padded[1:-1, 1:-1]
+        boundary = ((center != padded[:-2, 1:-1]) | (center != padded[2:, 1:-1]) |
+                    (center != padded[1:-1, :-2]) | (center != padded[1:-1, 2:]))
+
         result_mask = np.zeros((height, width), dtype=np.uint8)  # Black background
-        
-        # Draw all masks as white regions
-        for mask in masks:
-            seg = mask['segmentation'].astype(np.uint8)
-            result_mask[seg > 0] = 255  # Set segmented areas to white
-        
-        # Draw contours in black
-        for mask in masks:
-            seg = mask['segmentation'].astype(np.uint8)
-            contours, _ = cv2.findContours(seg.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            cv2.drawContours(result_mask, contours, -1, 0, 1)  # Black outlines
-        
+        result_mask[labels > 0] = 255  # Segmented areas in white
+        result_mask[boundary] = 0  # Black outlines
+        return result_mask
+
+    def save_segmentation_result(self, image, masks, output_path=None):
+        # Create a black background image with white regions and black outlines
+        result_mask = self.render_segmentation(image.shape, masks)
+
         # Save the result mask
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        cv2.imwrite(output_path, result_mask)
-        print(f"Saved segmentation result to {output_path}")
+        if output_path:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            cv2.imwrite(output_path, result_mask)
+            print(f"Saved segmentation result to {output_path}")
+        return result_mask
+
+    def cutouts(self, image, masks, image_name):
+        # Nothing is cropped or encoded until the caller asks for it
+        return LazyCutouts(image, masks, image_name)
 
     def save_cutouts(self, image, masks, output_dir, image_name):
-        # Create the output directory if it doesn't exist
-        os.makedirs(output_dir, exist_ok=True)
+        return self.cutouts(image, masks, image_name).write(output_dir)
+
+    def model_key(self):
+        return (self.model_type, os.path.basename(self.checkpoint_path), self.quantize, self.runtime)
+
+    def predictor(self, image):
+        """
+        Prompt-based predictor (points/boxes) for an RGB image, sharing the
+        embedding cache with mask generation.
+        """
+        if self.runtime == "onnx":
+            sessions = get_onnx_sessions(self.sam, onnx_model_name(self.model_key()))
+            predictor = OnnxSamPredictor(self.sam, sessions, self.model_key())
+        else:
+            predictor = CachedEmbeddingPredictor(self.sam, self.model_key())
+        predictor.set_image(image)
+        return predictor
+
+    def masks_cache_key(self, image_hash):
+        return make_key(image_hash, *self.model_key(), "cropped",
+                        self.profile, self.max_side, self.tile_size, self.tile_overlap)
+
+    def segment(self, image, image_hash=None, progress=None):
+        """
+        Generate masks for an RGB image, reusing cached masks when this exact
+        image was segmented before.
+
+        Args:
+            image: RGB image array
+            image_hash: Content hash of the upload; caching is skipped without it
+            progress: Optional callback(stage, **info) for stage-level progress
+
+        Returns:
+            SAM annotations with CroppedMask segmentations
+        """
+        masks_cache = get_result_cache().tier("sam_masks")
+        cache_key = self.masks_cache_key(image_hash) if image_hash else None
+        masks = masks_cache.get(cache_key) if cache_key else None
+        if masks is None:
+            masks = self.generate_masks(image)
+            if cache_key:
+                masks_cache.put(cache_key, masks)
+        print(f"Number of masks generated: {len(masks)}")
+        if progress:
+            progress("masks_generated", count=len(masks))
+        return masks
+
+    def process_image(self, input_path, output_dir="output_frag", image_hash=None, progress=None,
+                      save_result=True, write_cutouts=True):
+        # progress: optional callback(stage, **info) used by background jobs to report stages
+        # save_result: also write res_<name>.jpg; the composite is returned either way
+        # write_cutouts: write the per-object cutouts to output_dir/cutouts_<name>
+        report = progress if progress else (lambda stage, **info: None)
 
-        # Sort masks by area in descending order
-        sorted_masks = sorted(masks, key=lambda x: x['area'], reverse=True)
-
-        for i, ann in enumerate(sorted_masks):
-            # Create a mask for the current object
-            object_mask = ann['segmentation']
-            
-            # Create a masked image for this object
-            masked_image = image.copy()
-            masked_image[~object_mask] = 255  # Set non-mask areas to white
-            
-            # Crop the image to the bounding box of the mask
-            y_indices, x_indices = np.where(object_mask)
-            y_min, y_max = y_indices.min(), y_indices.max()
-            x_min, x_max = x_indices.min(), x_indices.max()
-            
-            cropped_image = masked_image[y_min:y_max+1, x_min:x_max+1]
-            
-            # Save the cropped image
-            output_filename = os.path.join(output_dir,  f"cutout_{image_name}_{i+1}.png")
-            cv2.imwrite(output_filename, cv2.cvtColor(cropped_image, cv2.COLOR_RGB2BGR))
-            print(f"Saved object {i+1} to {output_filename}")
-
-    def process_image(self, input_path, output_dir="output_frag"):
         # Get image name and extension
         image_basename = os.path.basename(input_path)
         image_name, _ = os.path.splitext(image_basename)
@@ -83,19 +229,20 @@ class SegmentAnythingPipeline:
         image = cv2.imread(input_path)
         if image is None:
             print(f"Error: Image not found at {input_path}")
-            return
+            return None
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-        # Generate masks
-        masks = self.generate_masks(image)
-        print(f"Number of masks generated: {len(masks)}")
+        masks = self.segment(image, image_hash=image_hash, progress=progress)
 
-        # Save main segmentation result
-        result_path = os.path.join(output_dir, f"res_{image_name}.jpg")
-        self.save_segmentation_result(image, masks, result_path)
+        # Render (and optionally save) the main segmentation result
+        result_path = os.path.join(output_dir, f"res_{image_name}.jpg") if save_result else None
+        composite = self.save_segmentation_result(image, masks, result_path)
+        report("segmentation_rendered")
 
         # Save cutouts to a properly named directory
-        cutouts_dir = os.path.join(output_dir, f"cutouts_{image_name}")
-        self.save_cutouts(image, masks, cutouts_dir, image_name)
+        if write_cutouts:
+            cutouts_dir = os.path.join(output_dir, f"cutouts_{image_name}")
+            written = self.save_cutouts(image, masks, cutouts_dir, image_name)
+            report("cutouts_written", count=len(written))
 
-        return result_path
\ No newline at end of file
+        return composite
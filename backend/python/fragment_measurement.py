@@ -0,0 +1,104 @@
+import cv2
+import numpy as np
+from geometry import max_diameters
+from metrics import timed
+
+
+def find_fragment_contours(image, invert=True, morph_close=True):
+    """
+    Threshold a black/white outline image and return the contours of its fragments.
+
+    Args:
+        image: BGR image (numpy array)
+        invert: Invert the grayscale image before thresholding
+        morph_close: Close small gaps in the outlines before finding contours
+
+    Returns:
+        list: Contours as returned by cv2.findContours (RETR_TREE)
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if invert:
+        gray = 255 - gray
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    if morph_close:
+        kernel = np.ones((3, 3), np.uint8)
+        thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+    contours, _ = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+def _bulk_bounding_boxes_and_areas(contours):
+    """
+    Bounding boxes and polygon areas of many contours using one pass over all points.
+    """
+    counts = np.fromiter((len(c) for c in contours), dtype=np.int64, count=len(contours))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    points = np.concatenate([c.reshape(-1, 2) for c in contours]).astype(np.int64)
+    x, y = points[:, 0], points[:, 1]
+
+    x_min = np.minimum.reduceat(x, starts)
+    y_min = np.minimum.reduceat(y, starts)
+    x_max = np.maximum.reduceat(x, starts)
+    y_max = np.maximum.reduceat(y, starts)
+    # Same convention as cv2.boundingRect: width/height include both end pixels
+    bboxes = np.stack([x_min, y_min, x_max - x_min + 1, y_max - y_min + 1], axis=1)
+
+    # Shoelace formula, each contour closed onto its own first point
+    next_idx = np.arange(1, len(points) + 1)
+    next_idx[starts + counts - 1] = starts
+    cross = x * y[next_idx] - x[next_idx] * y
+    areas = np.abs(np.add.reduceat(cross, starts)) / 2.0
+    return bboxes, areas
+
+
+@timed("contour_measurement")
+def measure_fragments(image, invert=True, morph_close=True, min_side=5):
+    """
+    Measure every fragment of an outline image in bulk, without rendering anything.
+
+    Args:
+        image: BGR image (numpy array)
+        invert: Invert the grayscale image before thresholding
+        morph_close: Close small gaps in the outlines before finding contours
+        min_side: Fragments whose bounding box is narrower or shorter than this are skipped
+
+    Returns:
+        dict with one entry per kept fragment, in contour order:
+            contours: list of kept contours
+            bboxes: (n, 4) int array of (x, y, w, h)
+            areas: (n,) polygon areas in px^2
+            equivalent_diameters: (n,) diameter of the circle with the same area, in px
+            longest_sides: (n,) Feret (maximum) diameters in px
+            longest_side_pt1 / longest_side_pt2: (n, 2) endpoints in image coordinates
+    """
+    contours = [c for c in find_fragment_contours(image, invert, morph_close) if len(c) > 0]
+    if not contours:
+        empty = np.zeros(0, dtype=np.float64)
+        return {
+            "contours": [],
+            "bboxes": np.zeros((0, 4), dtype=np.int64),
+            "areas": empty,
+            "equivalent_diameters": empty,
+            "longest_sides": empty,
+            "longest_side_pt1": np.zeros((0, 2), dtype=np.int64),
+            "longest_side_pt2": np.zeros((0, 2), dtype=np.int64),
+        }
+
+    bboxes, areas = _bulk_bounding_boxes_and_areas(contours)
+    keep = np.flatnonzero((bboxes[:, 2] >= min_side) & (bboxes[:, 3] >= min_side))
+    kept_contours = [contours[i] for i in keep]
+    bboxes = bboxes[keep]
+    areas = areas[keep]
+
+    longest_sides, pt1s, pt2s = max_diameters(kept_contours)
+    return {
+        "contours": kept_contours,
+        "bboxes": bboxes,
+        "areas": areas,
+        "equivalent_diameters": np.sqrt(4.0 * areas / np.pi),
+        "longest_sides": longest_sides,
+        "longest_side_pt1": pt1s,
+        "longest_side_pt2": pt2s,
+    }
@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+
+# Hulls up to this many vertices are measured with a vectorized all-pairs search,
+# which reproduces the endpoint choice of the old double loop exactly. Larger
+# hulls fall back to rotating calipers to keep memory linear.
+_PAIRWISE_MAX_HULL = 1024
+
+
+def _hull_points(points):
+    """Convex hull of a contour / point set as an (h, 2) int64 array."""
+    pts = np.asarray(points).reshape(-1, 2)
+    if len(pts) == 0:
+        return pts.astype(np.int64)
+    hull = cv2.convexHull(pts.astype(np.int32).reshape(-1, 1, 2))
+    return hull.reshape(-1, 2).astype(np.int64)
+
+
+def _pairwise_diameter(hull):
+    diff = hull[:, None, :] - hull[None, :, :]
+    d2 = (diff * diff).sum(axis=2)
+    # Keep pairs i < j only; argmax returns the first maximum in row-major
+    # order, i.e. the same pair the nested i/j loop used to settle on
+    d2[np.tril_indices(len(hull))] = -1
+    i, j = np.unravel_index(np.argmax(d2), d2.shape)
+    return d2[i, j], i, j
+
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def _calipers_diameter(hull):
+    pts = hull.tolist()
+    h = len(pts)
+    best, best_i, best_j = -1, 0, 0
+    j = 1
+    for i in range(h):
+        ni = (i + 1) % h
+        # Advance the antipodal pointer while the triangle area keeps growing
+        while abs(_cross(pts[i], pts[ni], pts[(j + 1) % h])) > abs(_cross(pts[i], pts[ni], pts[j])):
+            j = (j + 1) % h
+        for k in (i, ni):
+            dx = pts[k][0] - pts[j][0]
+            dy = pts[k][1] - pts[j][1]
+            d2 = dx * dx + dy * dy
+            if d2 > best:
+                best, best_i, best_j = d2, min(k, j), max(k, j)
+    return best, best_i, best_j
+
+
+def max_diameter(points):
+    """
+    Longest distance between two points of a contour (its Feret diameter).
+
+    Args:
+        points: Contour or point array, shape (n, 1, 2) or (n, 2), in (x, y) order
+
+    Returns:
+        tuple: (distance, pt1, pt2) with pt1/pt2 as (x, y) int tuples,
+               or (0, None, None) when fewer than two hull points exist
+    """
+    hull = _hull_points(points)
+    if len(hull) < 2:
+        return 0, None, None
+
+    if len(hull) <= _PAIRWISE_MAX_HULL:
+        d2, i, j = _pairwise_diameter(hull)
+    else:
+        d2, i, j = _calipers_diameter(hull)
+
+    pt1 = (int(hull[i][0]), int(hull[i][1]))
+    pt2 = (int(hull[j][0]), int(hull[j][1]))
+    return float(np.sqrt(d2)), pt1, pt2
+
+
+def max_diameters(contours):
+    """
+    Measure the Feret diameter of every contour of an image in one call.
+
+    Args:
+        contours: Sequence of contours as returned by cv2.findContours
+
+    Returns:
+        tuple: (distances, pt1s, pt2s) where distances is a float array of shape (n,)
+               and pt1s/pt2s are int arrays of shape (n, 2) (-1 where undefined)
+    """
+    n = len(contours)
+    distances = np.zeros(n, dtype=np.float64)
+    pt1s = np.full((n, 2), -1, dtype=np.int64)
+    pt2s = np.full((n, 2), -1, dtype=np.int64)
+    for idx, contour in enumerate(contours):
+        dist, pt1, pt2 = max_diameter(contour)
+        if pt1 is None:
+            continue
+        distances[idx] = dist
+        pt1s[idx] = pt1
+        pt2s[idx] = pt2
+    return distances, pt1s, pt2s
@@ -0,0 +1,250 @@
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from shared_state import get_state_store, pid_alive
+
+# Worker processes running jobs in parallel (each holds its own SAM model)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 1))
+# Jobs allowed to wait for a free worker before submissions are rejected
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 8))
+# Finished jobs kept for status/result lookups, across all worker processes
+JOB_HISTORY_SIZE = int(os.environ.get("JOB_HISTORY_SIZE", 256))
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a job is submitted while every worker and queue slot is taken."""
+
+
+class WorkerPoolError(RuntimeError):
+    """Raised when the job workers cannot accept a job, even after restarting them."""
+
+
+def _init_worker():
+    # Load the model (and open ONNX sessions) when the worker starts instead of inside the first job
+    from model_registry import warm_up
+    from sam_onnx import warm_up as warm_up_onnx
+    warm_up_onnx(warm_up())
+
+
+def _run_tracked(job_id, store, func, args, kwargs):
+    """
+    Executed in a worker process: runs `func` with a progress callback that
+    publishes stage updates to the shared state store.
+    """
+    stages = {}
+
+    def report(stage, **info):
+        stages[stage] = info
+        store.put(f"{job_id}.progress", {
+            "stage": stage,
+            "stages": dict(stages),
+            "updated_at": time.time(),
+        })
+
+    report("started", pid=os.getpid())
+    return func(*args, progress=report, **kwargs)
+
+
+def read_job_status(job_id, store=None):
+    """
+    Return the job's state ("queued", "running", "done", "failed") and its
+    stage-level progress, or None for an unknown id.
+
+    Reads only the shared state store, so any worker process can answer for a
+    job submitted through another one, without starting a job manager.
+    """
+    store = store if store is not None else get_state_store("jobs")
+    job = store.get(f"{job_id}.job")
+    if job is None:
+        return None
+    progress = store.get(f"{job_id}.progress")
+    outcome = store.get(f"{job_id}.result")
+    if outcome is None and not pid_alive(job["owner_pid"]):
+        # The worker that ran the job exited (crash or reload) before it finished
+        outcome = {"finished_at": time.time(), "value": None,
+                   "error": RuntimeError("The worker running this job exited")}
+        store.put(f"{job_id}.result", outcome)
+
+    if outcome is not None:
+        state = "failed" if outcome["error"] is not None else "done"
+    elif progress is not None:
+        state = "running"
+    else:
+        state = "queued"
+    status = {
+        "id": job_id,
+        "kind": job["kind"],
+        "state": state,
+        "submitted_at": job["submitted_at"],
+        "finished_at": outcome["finished_at"] if outcome is not None else None,
+        "progress": progress,
+    }
+    if state == "failed":
+        status["error"] = str(outcome["error"])
+    return status
+
+
+def read_job_result(job_id, store=None):
+    """
+    Return the job's result; raises the job's exception if it failed.
+    Only call once `read_job_status` reports "done" or "failed".
+    """
+    store = store if store is not None else get_state_store("jobs")
+    outcome = store.get(f"{job_id}.result")
+    if outcome is None:
+        raise RuntimeError(f"Job {job_id} has not finished")
+    if outcome["error"] is not None:
+        raise outcome["error"]
+    return outcome["value"]
+
+
+class JobManager:
+    """
+    Bounded, process-based executor for long-running work such as SAM segmentation.
+
+    `submit` returns a job id immediately; `status` and `result` report progress
+    and outcome. Jobs run in separate processes so segmentation never competes
+    with request threads for the GIL or torch's thread pool. Status, progress and
+    results are kept in the shared state store, visible to every worker process.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, max_queue=JOB_QUEUE_SIZE, history_size=JOB_HISTORY_SIZE,
+                 initializer=_init_worker, store=None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.history_size = history_size
+        self._store = store if store is not None else get_state_store("jobs")
+        self._initializer = initializer
+        self._executor = self._new_executor()
+        # Unfinished jobs submitted through this manager, bounding its queue
+        self._futures = {}
+        # Reentrant: done-callbacks can fire synchronously while submit holds the lock
+        self._lock = threading.RLock()
+
+    def _new_executor(self):
+        # spawn: forking a process that already runs torch threads can deadlock
+        context = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                   initializer=self._initializer)
+
+    def _replace_broken(self, executor):
+        """
+        Start a fresh pool in place of `executor` once one of its workers died
+        (e.g. killed for running out of memory): a broken pool rejects every job.
+        """
+        with self._lock:
+            if self._executor is not executor:
+                return  # already replaced by another failed job or submit
+            print("A job worker died, restarting the job worker pool")
+            self._executor = self._new_executor()
+        executor.shutdown(wait=False)
+
+    def submit(self, kind, func, *args, **kwargs):
+        """
+        Queue `func(*args, progress=callback, **kwargs)` for execution in a worker.
+
+        Raises:
+            QueueFullError: if all workers are busy and the queue is full
+            WorkerPoolError: if the worker pool is broken and a restarted one fails too
+        """
+        with self._lock:
+            if len(self._futures) >= self.max_workers + self.max_queue:
+                raise QueueFullError("Job queue is full, retry later")
+            job_id = str(uuid.uuid4())
+            self._store.put(f"{job_id}.job", {
+                "kind": kind,
+                "submitted_at": time.time(),
+                "owner_pid": os.getpid(),
+            })
+            try:
+                try:
+                    executor = self._executor
+                    future = executor.submit(_run_tracked, job_id, self._store, func, args, kwargs)
+                except BrokenProcessPool:
+                    # Its jobs are failed by _on_done; retry once on a fresh pool
+                    self._replace_broken(executor)
+                    executor = self._executor
+                    try:
+                        future = executor.submit(_run_tracked, job_id, self._store, func, args, kwargs)
+                    except BrokenProcessPool as e:
+                        self._replace_broken(executor)
+                        raise WorkerPoolError("Job workers are restarting, retry later") from e
+            except BaseException:
+                self._store.delete(f"{job_id}.job")
+                raise
+            self._futures[job_id] = future
+            future.add_done_callback(lambda f, job_id=job_id, executor=executor:
+                                     self._on_done(job_id, f, executor))
+        return job_id
+
+    def _on_done(self, job_id, future, executor=None):
+        if future.cancelled():
+            error, value = RuntimeError("Job was cancelled"), None
+        else:
+            error = future.exception()
+            value = future.result() if error is None else None
+        if isinstance(error, BrokenProcessPool):
+            # Every unfinished job of the pool ends up here; the pool is replaced once
+            error = RuntimeError("The job worker process died (e.g. out of memory)")
+            if executor is not None:
+                self._replace_broken(executor)
+        try:
+            self._store.put(f"{job_id}.result", {"finished_at": time.time(), "value": value, "error": error})
+        except Exception as e:
+            # Unpicklable result or exception: keep at least the message
+            self._store.put(f"{job_id}.result", {"finished_at": time.time(), "value": None,
+                                                 "error": RuntimeError(str(error if error is not None else e))})
+        with self._lock:
+            self._futures.pop(job_id, None)
+        self._trim_history()
+
+    def _trim_history(self):
+        finished = self._store.keys(".result")
+        for key in finished[:max(len(finished) - self.history_size, 0)]:
+            job_id = key[:-len(".result")]
+            for part in ("job", "progress", "result"):
+                self._store.delete(f"{job_id}.{part}")
+
+    def status(self, job_id):
+        return read_job_status(job_id, self._store)
+
+    def result(self, job_id):
+        return read_job_result(job_id, self._store)
+
+    def stats(self):
+        with self._lock:
+            active = len(self._futures)
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "active": active,
+            "queued": max(active - self.max_workers, 0),
+            "tracked": len(self._store.keys(".job")),
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Return the process-wide job manager, starting its workers on first use."""
+    global _job_manager
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                _job_manager = JobManager()
+    return _job_manager
+
+
+def peek_job_manager():
+    """Return the job manager if it has been started, without starting it."""
+    return _job_manager
@@ -2,44 +2,69 @@
 import numpy as np
 import math
 
-def kuz_ram_model(A, K, Q, E, n):
+# Fraction passing at X50 used by the Rosin-Rammler characteristic size (ln 2 rounded)
+X50_PASSING = 0.693
+
+
+def kuz_ram_batch(A, K, Q, E, n, percentiles=(10, 20, 80, 90, 99), cutoff=60):
+    """
+    Evaluate the Kuz-Ram model for many blast designs in one vectorized call.
+
+    Percentile sizes come from the inverse Rosin-Rammler function
+    x = Xc * (-ln(1 - p))^(1/n), so they are exact rather than read off a grid.
+
+    Args:
+        A, K, Q, E, n: Scalars or broadcastable arrays of rock factor, powder factor,
+                       charge per hole, relative weight strength and uniformity index
+        percentiles: Passing percentages to compute sizes for
+        cutoff: Size for the passing/retained split (same units as X50)
+
+    Returns:
+        dict of numpy arrays: X50, Xc, one "P<p>" entry per percentile,
+        percentage_below_<cutoff> and percentage_above_<cutoff>
+    """
+    A, K, Q, E, n = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (A, K, Q, E, n)))
     X50 = A * Q**(0.17) * (115 / E)**(0.63) * K**(-0.8)
-    Xc = X50 / (0.693)**(1/n)
-    sizes = np.linspace(1, 3 * X50, 100)
-    distribution = 100 * (1 - np.exp(- (sizes / Xc)**n))
-    
-    def get_percentile(percentile):
-        indices = np.where(distribution >= percentile)[0]
-        if len(indices) > 0:
-            return sizes[indices[0]]
-        return None
-    
-    P10 = get_percentile(10)
-    P20 = get_percentile(20)
-    P80 = get_percentile(80)
-    P90 = get_percentile(90)
-    TopSize = get_percentile(99)
-    below_60 = np.where(sizes <= 60)[0][-1]
-    percentage_below_60 = distribution[below_60]
-    percentage_above_60 = 100 - percentage_below_60
+    Xc = X50 / (X50_PASSING)**(1 / n)
+
+    result = {"X50": X50, "Xc": Xc}
+    for p in percentiles:
+        result[f"P{p:g}"] = Xc * (-np.log1p(-p / 100.0))**(1 / n)
+
+    below = 100 * (1 - np.exp(-(cutoff / Xc)**n))
+    result[f"percentage_below_{cutoff:g}"] = below
+    result[f"percentage_above_{cutoff:g}"] = 100 - below
+    return result
+
+
+def rosin_rammler_curve(X50, n, sizes):
+    """
+    Cumulative percentage passing at the given sizes.
+    """
+    Xc = X50 / (X50_PASSING)**(1 / n)
+    return 100 * (1 - np.exp(- (np.asarray(sizes) / Xc)**n))
+
+
+def kuz_ram_model(A, K, Q, E, n):
+    batch = kuz_ram_batch(A, K, Q, E, n)
 
     return {
-        "X50": float(X50),
-        "P10": float(P10) if P10 is not None else None,
-        "P20": float(P20) if P20 is not None else None,
-        "P80": float(P80) if P80 is not None else None,
-        "P90": float(P90) if P90 is not None else None,
-        "TopSize": float(TopSize) if TopSize is not None else None,
-        "percentage_below_60": float(percentage_below_60),
-        "percentage_above_60": float(percentage_above_60)
+        "X50": float(batch["X50"]),
+        "P10": float(batch["P10"]),
+        "P20": float(batch["P20"]),
+        "P80": float(batch["P80"]),
+        "P90": float(batch["P90"]),
+        "TopSize": float(batch["P99"]),
+        "percentage_below_60": float(batch["percentage_below_60"]),
+        "percentage_above_60": float(batch["percentage_above_60"])
     }
 
 # For standalone testing, uncomment below:
 # if __name__ == '__main__':
-#     A = 5.955  
-#     K = 0.139  
-#     Q = 66.725  
-#     E = 100    
-#     n = 1.851  
+#     A = 5.955
+#     K = 0.139
+#     Q = 66.725
+#     E = 100
+#     n = 1.851
 #     result = kuz_ram_model(A, K, Q, E, n)
 #     print(result)
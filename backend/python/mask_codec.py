@@ -0,0 +1,261 @@
+import cv2
+import numpy as np
+
+
+class CroppedMask:
+    """
+    A binary mask stored as its tight bounding-box crop plus the crop offset.
+
+    Memory scales with the object's extent instead of the full image size, so a
+    photo with hundreds of masks no longer needs one full-resolution array each.
+    Consumers work on `mask` (crop coordinates) and use `x`/`y` to place it.
+    """
+
+    __slots__ = ("x", "y", "mask", "image_shape")
+
+    def __init__(self, x, y, mask, image_shape):
+        self.x = int(x)
+        self.y = int(y)
+        self.mask = mask
+        self.image_shape = (int(image_shape[0]), int(image_shape[1]))
+
+    @property
+    def bbox(self):
+        """(x, y, w, h) of the crop in image coordinates."""
+        h, w = self.mask.shape
+        return self.x, self.y, w, h
+
+    @property
+    def slices(self):
+        """(row slice, column slice) selecting the crop region of a full image."""
+        h, w = self.mask.shape
+        return slice(self.y, self.y + h), slice(self.x, self.x + w)
+
+    @property
+    def area(self):
+        return int(np.count_nonzero(self.mask))
+
+    @property
+    def nbytes(self):
+        return self.mask.nbytes
+
+    def to_full(self):
+        """Decode to a full-resolution boolean mask (avoid in hot paths)."""
+        full = np.zeros(self.image_shape, dtype=bool)
+        full[self.slices] = self.mask
+        return full
+
+    def translate(self, dx, dy, image_shape):
+        """Same crop placed at (x + dx, y + dy) inside a larger image."""
+        return CroppedMask(self.x + dx, self.y + dy, self.mask, image_shape)
+
+    def rescale(self, image_shape):
+        """
+        Nearest-neighbour resize to another resolution of the same image, touching
+        only the crop. Used to bring masks from the working resolution back to the
+        original photo's pixel grid.
+        """
+        src_h, src_w = self.image_shape
+        dst_h, dst_w = int(image_shape[0]), int(image_shape[1])
+        h, w = self.mask.shape
+        if h == 0 or w == 0:
+            return CroppedMask(0, 0, self.mask, image_shape)
+        x0 = int(round(self.x * dst_w / src_w))
+        y0 = int(round(self.y * dst_h / src_h))
+        x1 = max(int(round((self.x + w) * dst_w / src_w)), x0 + 1)
+        y1 = max(int(round((self.y + h) * dst_h / src_h)), y0 + 1)
+        resized = cv2.resize(self.mask.view(np.uint8), (x1 - x0, y1 - y0), interpolation=cv2.INTER_NEAREST)
+        trimmed = CroppedMask.from_full(resized > 0)
+        if trimmed.mask.size == 0:
+            return CroppedMask(0, 0, trimmed.mask, image_shape)
+        return CroppedMask(x0 + trimmed.x, y0 + trimmed.y, trimmed.mask, image_shape)
+
+    @classmethod
+    def from_full(cls, mask):
+        """Build from a full-resolution boolean mask."""
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if rows.size == 0:
+            return cls(0, 0, np.zeros((0, 0), dtype=bool), mask.shape)
+        crop = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1].astype(bool, copy=True)
+        return cls(cols[0], rows[0], crop, mask.shape)
+
+    @classmethod
+    def from_rle(cls, rle):
+        """
+        Build from SAM's uncompressed RLE ({"size": [h, w], "counts": [...]}),
+        decoding only the columns the object spans.
+
+        The RLE is column-major and starts with a run of zeros, so odd runs are
+        foreground; their flat positions give the column range directly.
+        """
+        h, w = rle["size"]
+        counts = np.asarray(rle["counts"], dtype=np.int64)
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        fg_starts = starts[1::2]
+        fg_ends = ends[1::2]
+        nonempty = fg_ends > fg_starts
+        fg_starts, fg_ends = fg_starts[nonempty], fg_ends[nonempty]
+        if fg_starts.size == 0:
+            return cls(0, 0, np.zeros((0, 0), dtype=bool), (h, w))
+
+        x0 = int(fg_starts[0] // h)
+        x1 = int((fg_ends[-1] - 1) // h)
+        lo = x0 * h
+        length = (x1 - x0 + 1) * h
+
+        # Paint the runs with a difference array over the column range only
+        diff = np.zeros(length + 1, dtype=np.int32)
+        np.add.at(diff, fg_starts - lo, 1)
+        np.add.at(diff, fg_ends - lo, -1)
+        columns = np.cumsum(diff[:-1]) > 0
+        crop = columns.reshape(x1 - x0 + 1, h).T
+
+        rows = np.flatnonzero(crop.any(axis=1))
+        crop = np.ascontiguousarray(crop[rows[0]:rows[-1] + 1])
+        return cls(x0, rows[0], crop, (h, w))
+
+
+def overlap_area(a, b):
+    """Number of pixels set in both masks, computed on the shared bbox region only."""
+    ax, ay, aw, ah = a.bbox
+    bx, by, bw, bh = b.bbox
+    x0, y0 = max(ax, bx), max(ay, by)
+    x1, y1 = min(ax + aw, bx + bw), min(ay + ah, by + bh)
+    if x1 <= x0 or y1 <= y0:
+        return 0
+    return int(np.count_nonzero(a.mask[y0 - ay:y1 - ay, x0 - ax:x1 - ax] &
+                                b.mask[y0 - by:y1 - by, x0 - bx:x1 - bx]))
+
+
+def union_masks(masks):
+    """Union of CroppedMasks sharing one image, as a single CroppedMask."""
+    masks = [m for m in masks if m.mask.size]
+    if not masks:
+        raise ValueError("union_masks needs at least one non-empty mask")
+    x0 = min(m.x for m in masks)
+    y0 = min(m.y for m in masks)
+    x1 = max(m.x + m.mask.shape[1] for m in masks)
+    y1 = max(m.y + m.mask.shape[0] for m in masks)
+    merged = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+    for m in masks:
+        h, w = m.mask.shape
+        merged[m.y - y0:m.y - y0 + h, m.x - x0:m.x - x0 + w] |= m.mask
+    return CroppedMask(x0, y0, merged, masks[0].image_shape)
+
+
+def compact_masks(anns):
+    """
+    Replace the RLE segmentation of SAM annotations with CroppedMask objects, in place.
+
+    Args:
+        anns: Annotations from SamAutomaticMaskGenerator(output_mode="uncompressed_rle")
+
+    Returns:
+        The same list, for chaining
+    """
+    for ann in anns:
+        seg = ann["segmentation"]
+        if isinstance(seg, dict):
+            ann["segmentation"] = CroppedMask.from_rle(seg)
+        elif isinstance(seg, np.ndarray):
+            ann["segmentation"] = CroppedMask.from_full(seg)
+    return anns
+
+
+def _retrim(seg, mask):
+    # Shrink the crop to the pixels still set, keeping image coordinates
+    trimmed = CroppedMask.from_full(mask)
+    if trimmed.mask.size == 0:
+        return CroppedMask(0, 0, trimmed.mask, seg.image_shape)
+    return CroppedMask(seg.x + trimmed.x, seg.y + trimmed.y, trimmed.mask, seg.image_shape)
+
+
+def _fill_small_holes(seg, min_area):
+    h, w = seg.mask.shape
+    height, width = seg.image_shape
+    # Background padding on the sides facing the rest of the image: gaps reaching
+    # those sides open onto the area outside the crop, so they are not holes
+    pad = ((int(seg.y > 0), int(seg.y + h < height)), (int(seg.x > 0), int(seg.x + w < width)))
+    background = np.pad(~seg.mask, pad, constant_values=True)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(background.astype(np.uint8), connectivity=8)
+    outside = np.ones(labels.shape, dtype=bool)
+    outside[pad[0][0]:pad[0][0] + h, pad[1][0]:pad[1][0] + w] = False
+    open_labels = np.unique(labels[outside])
+    small = [label for label in range(1, count)
+             if stats[label, cv2.CC_STAT_AREA] < min_area and label not in open_labels]
+    if not small:
+        return seg, False
+    holes = np.isin(labels[pad[0][0]:pad[0][0] + h, pad[1][0]:pad[1][0] + w], small)
+    return CroppedMask(seg.x, seg.y, seg.mask | holes, seg.image_shape), True
+
+
+def _drop_small_islands(seg, min_area):
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(seg.mask.astype(np.uint8), connectivity=8)
+    sizes = stats[1:, cv2.CC_STAT_AREA]
+    if not (sizes < min_area).any():
+        return seg, False
+    keep = np.flatnonzero(sizes >= min_area) + 1
+    if keep.size == 0:
+        # Like SAM, never erase a mask entirely: keep its largest island
+        keep = [int(np.argmax(sizes)) + 1]
+    return _retrim(seg, np.isin(labels, keep)), True
+
+
+def _box_nms(boxes, order, iou_thresh):
+    """Greedy NMS over (x0, y0, x1, y1) boxes visited in `order`; returns kept indices."""
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    for index in order:
+        if keep:
+            kept = boxes[keep]
+            w = np.clip(np.minimum(kept[:, 2], boxes[index, 2]) - np.maximum(kept[:, 0], boxes[index, 0]), 0, None)
+            h = np.clip(np.minimum(kept[:, 3], boxes[index, 3]) - np.maximum(kept[:, 1], boxes[index, 1]), 0, None)
+            inter = w * h
+            iou = inter / np.maximum(areas[keep] + areas[index] - inter, 1)
+            if (iou > iou_thresh).any():
+                continue
+        keep.append(index)
+    return keep
+
+
+def remove_small_regions(anns, min_area, nms_thresh):
+    """
+    Fill small holes and drop small islands of compacted masks, working on each
+    bounding-box crop. Equivalent to SamAutomaticMaskGenerator's
+    min_mask_region_area, which decodes every mask to full resolution first.
+
+    Masks that changed are re-trimmed, then a box NMS preferring unchanged masks
+    removes the duplicates the cleanup can create, as SAM does.
+
+    Args:
+        anns: Annotations with CroppedMask segmentations (see compact_masks)
+        min_area: Holes and islands smaller than this many pixels are removed
+        nms_thresh: Box IoU above which the less preferred mask is dropped
+
+    Returns:
+        The kept annotations, in their original order
+    """
+    changed = []
+    for ann in anns:
+        seg = ann["segmentation"]
+        if seg.mask.size == 0:
+            changed.append(False)
+            continue
+        seg, filled = _fill_small_holes(seg, min_area)
+        seg, dropped = _drop_small_islands(seg, min_area)
+        if filled or dropped:
+            ann["segmentation"] = seg
+            ann["area"] = seg.area
+            ann["bbox"] = list(seg.bbox)
+        changed.append(filled or dropped)
+    if not any(changed):
+        return anns
+
+    boxes = np.array([[x, y, x + w, y + h] for x, y, w, h in (ann["segmentation"].bbox for ann in anns)],
+                     dtype=np.float64)
+    # Unchanged masks first, otherwise in generation order
+    order = sorted(range(len(anns)), key=lambda index: changed[index])
+    keep = set(_box_nms(boxes, order, nms_thresh))
+    return [ann for index, ann in enumerate(anns) if index in keep]
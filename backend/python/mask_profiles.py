@@ -0,0 +1,122 @@
+import os
+import threading
+
+from segment_anything import SamAutomaticMaskGenerator
+
+from mask_codec import remove_small_regions
+from sam_embeddings import CachedEmbeddingPredictor
+from sam_onnx import OnnxSamPredictor, get_onnx_sessions, onnx_model_name
+
+# Named speed/quality trade-offs for SamAutomaticMaskGenerator.
+# "standard" is SAM's own defaults, i.e. what every request used before profiles.
+MASK_PROFILES = {
+    # Instant feedback on the phone: coarse point grid, no crop layers
+    "preview": {
+        "points_per_side": 16,
+        "points_per_batch": 128,
+        "pred_iou_thresh": 0.86,
+        "stability_score_thresh": 0.92,
+        "crop_n_layers": 0,
+        "min_region_area": 0,
+    },
+    "standard": {
+        "points_per_side": 32,
+        "points_per_batch": 64,
+        "pred_iou_thresh": 0.88,
+        "stability_score_thresh": 0.95,
+        "crop_n_layers": 0,
+        "min_region_area": 0,
+    },
+    # Final reports: denser grid plus one crop layer for small fragments,
+    # and speckle removal
+    "survey": {
+        "points_per_side": 48,
+        "points_per_batch": 64,
+        "pred_iou_thresh": 0.88,
+        "stability_score_thresh": 0.92,
+        "crop_n_layers": 1,
+        "crop_n_points_downscale_factor": 2,
+        "min_region_area": 100,
+    },
+}
+DEFAULT_MASK_PROFILE = os.environ.get("SAM_PROFILE", "standard")
+
+# Profile settings applied to the compacted masks instead of being passed to SAM.
+# min_region_area replaces SAM's min_mask_region_area, which decodes every mask
+# to a full-resolution array (see mask_codec.remove_small_regions)
+POSTPROCESS_SETTINGS = ("min_region_area",)
+
+# One generator per (model, profile), each with a lock: the generator's predictor
+# holds the current image's embedding, so a generator serves one image at a time
+_generators = {}
+_generators_lock = threading.Lock()
+
+
+class UnknownProfileError(ValueError):
+    """Raised when a request names a mask profile that does not exist."""
+
+
+def resolve_profile(profile):
+    """Return a valid profile name, defaulting when none is given."""
+    profile = profile or DEFAULT_MASK_PROFILE
+    if profile not in MASK_PROFILES:
+        raise UnknownProfileError(f"Unknown profile '{profile}', expected one of: {', '.join(MASK_PROFILES)}")
+    return profile
+
+
+def generator_settings(profile):
+    """SamAutomaticMaskGenerator keyword arguments of a profile."""
+    return {key: value for key, value in MASK_PROFILES[profile].items() if key not in POSTPROCESS_SETTINGS}
+
+
+def postprocess_masks(anns, profile, generator):
+    """
+    Apply a profile's post-generation settings to compacted annotations.
+
+    Args:
+        anns: Annotations with CroppedMask segmentations (see mask_codec.compact_masks)
+        profile: Name of a MASK_PROFILES entry
+        generator: The generator that produced the annotations, for its NMS thresholds
+
+    Returns:
+        The kept annotations
+    """
+    min_area = MASK_PROFILES[profile].get("min_region_area", 0)
+    if min_area > 0:
+        anns = remove_small_regions(anns, min_area, max(generator.box_nms_thresh, generator.crop_nms_thresh))
+    return anns
+
+
+def get_mask_generator(sam, profile, model_key, runtime="torch"):
+    """
+    Return the shared generator and its lock for the given model and profile,
+    creating it on first use.
+
+    Args:
+        sam: Loaded SAM model
+        profile: Name of a MASK_PROFILES entry
+        model_key: Identifies the model weights, namespacing cached embeddings
+        runtime: "torch" for eager PyTorch, "onnx" for the ONNX Runtime predictor
+
+    Returns:
+        (SamAutomaticMaskGenerator, threading.Lock)
+    """
+    profile = resolve_profile(profile)
+    key = (id(sam), profile, runtime)
+    entry = _generators.get(key)
+    if entry is None:
+        with _generators_lock:
+            entry = _generators.get(key)
+            if entry is None:
+                # RLE output avoids SAM materializing a full-size bool array per mask
+                generator = SamAutomaticMaskGenerator(sam, output_mode="uncompressed_rle",
+                                                      **generator_settings(profile))
+                # Reuse image embeddings across profiles and repeated requests
+                if runtime == "onnx":
+                    sessions = get_onnx_sessions(sam, onnx_model_name(model_key))
+                    generator.predictor = OnnxSamPredictor(sam, sessions, model_key)
+                else:
+                    generator.predictor = CachedEmbeddingPredictor(sam, model_key)
+                entry = (generator, threading.Lock())
+                _generators[key] = entry
+    return entry
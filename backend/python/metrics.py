@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+from shared_state import pid_alive
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Directory where every process (prefork workers, job workers) publishes its
+# metrics so /metrics can aggregate them; unset keeps metrics per process
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 5))
+
+STAGE_METRIC = "pipeline_stage_duration_seconds"
+_HELP = {
+    STAGE_METRIC: "Time spent in each pipeline stage.",
+    "http_requests_total": "HTTP requests by endpoint, method and status.",
+    "http_request_duration_seconds": "HTTP request latency by endpoint.",
+    "serve_requests_waiting": "Requests waiting for a concurrency slot, summed over workers.",
+    "serve_requests_in_flight": "Requests holding a concurrency slot, summed over workers.",
+    "serve_rejected_total": "Requests rejected with 503 after waiting for a concurrency slot.",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process store of counters, gauges and latency histograms,
+    rendered in the Prometheus text exposition format.
+
+    Recording a value is a dict lookup and a few additions under one lock, so
+    spans can wrap hot pipeline stages without measurable overhead.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}    # name -> {label key: value}
+        self._gauges = {}      # name -> {label key: value}
+        self._histograms = {}  # name -> {label key: [bucket counts..., sum, count]}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def add_gauge(self, name, delta, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            series[key] = series.get(key, 0) + delta
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        """JSON-serializable copy of all series."""
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "counters": {name: [[list(map(list, key)), value] for key, value in series.items()]
+                             for name, series in self._counters.items()},
+                "gauges": {name: [[list(map(list, key)), value] for key, value in series.items()]
+                           for name, series in self._gauges.items()},
+                "histograms": {name: [[list(map(list, key)), list(state)] for key, state in series.items()]
+                               for name, series in self._histograms.items()},
+            }
+
+
+def merge_snapshots(snapshots):
+    """Sum counters, gauges and histograms of several snapshots with identical buckets."""
+    counters, gauges, histograms, buckets = {}, {}, {}, list(DEFAULT_BUCKETS)
+    for snap in snapshots:
+        if snap.get("buckets") != buckets:
+            continue
+        for target, kind in ((counters, "counters"), (gauges, "gauges")):
+            for name, series in snap.get(kind, {}).items():
+                merged = target.setdefault(name, {})
+                for key, value in series:
+                    key = tuple(map(tuple, key))
+                    merged[key] = merged.get(key, 0) + value
+        for name, series in snap["histograms"].items():
+            merged = histograms.setdefault(name, {})
+            for key, state in series:
+                key = tuple(map(tuple, key))
+                current = merged.get(key)
+                merged[key] = list(state) if current is None else [a + b for a, b in zip(current, state)]
+    return buckets, counters, gauges, histograms
+
+
+def render_prometheus(snapshots, gauges=None):
+    """
+    Prometheus text format for merged snapshots plus point-in-time gauges.
+
+    Args:
+        snapshots: Registry snapshots to aggregate
+        gauges: Optional extra {name: (help, [(labels dict, value), ...])} read at scrape time
+    """
+    buckets, counters, merged_gauges, histograms = merge_snapshots(snapshots)
+    lines = []
+    for kind, series_by_name in (("counter", counters), ("gauge", merged_gauges)):
+        for name in sorted(series_by_name):
+            lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(series_by_name[name].items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+    for name in sorted(histograms):
+        lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, state in sorted(histograms[name].items()):
+            for bound, count in zip(buckets, state):
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', repr(float(bound)))])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {state[-1]}")
+            lines.append(f"{name}_sum{_format_labels(key)} {state[-2]}")
+            lines.append(f"{name}_count{_format_labels(key)} {state[-1]}")
+    for name, (help_text, samples) in sorted((gauges or {}).items()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(_label_key(labels))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def get_registry():
+    return _registry
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f"metrics_{pid}.json")
+
+
+def flush():
+    """Publish this process's snapshot to METRICS_DIR (no-op when unset)."""
+    if not METRICS_DIR:
+        return
+    path = _snapshot_path(os.getpid())
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(_registry.snapshot(), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write metrics snapshot: {e}")
+
+
+def clear_snapshots():
+    """Remove published snapshots, e.g. from a previous server run."""
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    for filename in os.listdir(METRICS_DIR):
+        if filename.startswith("metrics_"):
+            try:
+                os.remove(os.path.join(METRICS_DIR, filename))
+            except OSError:
+                pass
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        flush()
+
+
+def _ensure_flusher():
+    # Started lazily per process, so forked and spawned workers each get one
+    global _flusher
+    if not METRICS_DIR or (_flusher is not None and _flusher[0] == os.getpid()):
+        return
+    with _flusher_lock:
+        if _flusher is None or _flusher[0] != os.getpid():
+            thread = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+            thread.start()
+            _flusher = (os.getpid(), thread)
+
+
+def collect_snapshots():
+    """
+    This process's live snapshot plus those published by other live processes.
+    Snapshots of processes that exited (replaced workers, finished job pools) are
+    deleted, so their counts and gauges drop out instead of piling up.
+    """
+    snapshots = [_registry.snapshot()]
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        own = os.path.basename(_snapshot_path(os.getpid()))
+        for filename in os.listdir(METRICS_DIR):
+            if filename == own or not filename.startswith("metrics_") or not filename.endswith(".json"):
+                continue
+            pid = filename[len("metrics_"):-len(".json")]
+            if pid.isdigit() and not pid_alive(int(pid)):
+                try:
+                    os.remove(os.path.join(METRICS_DIR, filename))
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return snapshots
+
+
+def inc(name, value=1, **labels):
+    _ensure_flusher()
+    _registry.inc(name, value, **labels)
+
+
+def add_gauge(name, delta, **labels):
+    _ensure_flusher()
+    _registry.add_gauge(name, delta, **labels)
+
+
+def observe(name, value, **labels):
+    _ensure_flusher()
+    _registry.observe(name, value, **labels)
+
+
+@contextmanager
+def span(stage, **labels):
+    """
+    Time a pipeline stage into the pipeline_stage_duration_seconds histogram.
+
+    Example:
+        with span("marker_detection"):
+            ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(STAGE_METRIC, time.perf_counter() - start, stage=stage, **labels)
+
+
+def timed(stage):
+    """Decorator form of span()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,255 @@
+import os
+import time
+import threading
+import torch
+from segment_anything import sam_model_registry
+
+# Official checkpoints per backbone; lighter backbones trade accuracy for CPU speed
+SAM_CHECKPOINTS = {
+    "vit_h": "sam_vit_h_4b8939.pth",
+    "vit_l": "sam_vit_l_0b3195.pth",
+    "vit_b": "sam_vit_b_01ec64.pth",
+}
+# Per-deployment backend selection (see benchmark_sam.py for the trade-offs)
+SAM_MODEL_TYPE = os.environ.get("SAM_MODEL_TYPE", "vit_h")
+SAM_CHECKPOINT = os.environ.get("SAM_CHECKPOINT")
+# "int8": dynamically quantize the image encoder's linear layers (CPU only)
+SAM_QUANTIZE = os.environ.get("SAM_QUANTIZE", "none").lower()
+QUANTIZE_MODES = ("none", "int8")
+# Memory-map checkpoint weights so workers share them through the page cache
+SAM_MMAP = os.environ.get("SAM_MMAP", "1").lower() in ("1", "true", "yes")
+# Sam's normalization constants are non-persistent buffers, absent from checkpoints
+_PIXEL_MEAN = [123.675, 116.28, 103.53]
+_PIXEL_STD = [58.395, 57.12, 57.375]
+
+# Process-wide cache of loaded SAM models keyed by (model_type, checkpoint, device, quantize).
+# Models are loaded once and shared by every SegmentAnythingPipeline in the process.
+# When the app is preloaded before forking workers, the weights are inherited
+# copy-on-write instead of being read from disk again in each worker; with mmap
+# loading, even separately started workers share them through the page cache.
+_models = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def _current_rss_bytes():
+    """
+    Return the resident set size of this process in bytes (0 if unavailable).
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # ru_maxrss is the peak, in kilobytes on Linux; best effort elsewhere.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except (ImportError, AttributeError):
+        return 0
+
+
+def _private_rss_bytes():
+    """
+    Return the anonymous (private) part of the resident set in bytes, 0 if unavailable.
+    Memory-mapped weights count as file-backed pages instead, shared between workers.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def default_device():
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def sam_backend(model_type=None, checkpoint_path=None, quantize=None):
+    """
+    Resolve a backend selection, filling unset values from SAM_MODEL_TYPE,
+    SAM_CHECKPOINT and SAM_QUANTIZE.
+
+    Returns:
+        (model_type, checkpoint_path, quantize)
+    """
+    model_type = model_type or SAM_MODEL_TYPE
+    if model_type not in SAM_CHECKPOINTS:
+        raise ValueError(f"Unknown SAM model type '{model_type}', expected one of: {', '.join(SAM_CHECKPOINTS)}")
+    if checkpoint_path is None:
+        checkpoint_path = SAM_CHECKPOINT if SAM_CHECKPOINT and model_type == SAM_MODEL_TYPE \
+            else SAM_CHECKPOINTS[model_type]
+    quantize = (quantize or SAM_QUANTIZE).lower()
+    if quantize not in QUANTIZE_MODES:
+        raise ValueError(f"Unknown quantization '{quantize}', expected one of: {', '.join(QUANTIZE_MODES)}")
+    return model_type, checkpoint_path, quantize
+
+
+def quantize_image_encoder(model):
+    """
+    Replace the image encoder's nn.Linear layers with int8 dynamically quantized
+    ones. The encoder's attention and MLP blocks are almost all linear layers, so
+    this covers most of its compute; the prompt encoder and mask decoder stay fp32.
+    """
+    from torch.ao.quantization import quantize_dynamic
+    model.image_encoder = quantize_dynamic(model.image_encoder, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def load_sam_mmap(model_type, checkpoint_path):
+    """
+    Build a SAM model whose weights are memory-mapped views of the checkpoint.
+
+    The model is constructed on the meta device (no random init, no allocation)
+    and the mmap-backed tensors are assigned in place, so the weights live in
+    the page cache and are shared by every process that maps the same file.
+    """
+    state_dict = torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
+    with torch.device("meta"):
+        model = sam_model_registry[model_type](checkpoint=None)
+    model.load_state_dict(state_dict, assign=True)
+    model.register_buffer("pixel_mean", torch.tensor(_PIXEL_MEAN).view(-1, 1, 1), False)
+    model.register_buffer("pixel_std", torch.tensor(_PIXEL_STD).view(-1, 1, 1), False)
+    missing = [name for name, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    if missing:
+        raise RuntimeError(f"Checkpoint {checkpoint_path} does not provide: {', '.join(missing)}")
+    return model.eval()
+
+
+def convert_checkpoint(src_path, dst_path):
+    """
+    Re-save a checkpoint as a plain state dict in torch's current zip format,
+    which torch.load(mmap=True) can map (older pickled files cannot be mapped).
+    """
+    state_dict = torch.load(src_path, map_location="cpu", weights_only=True)
+    if "model" in state_dict and isinstance(state_dict["model"], dict):
+        state_dict = state_dict["model"]
+    state_dict = {name: t.contiguous() for name, t in state_dict.items()}
+    tmp_path = f"{dst_path}.tmp"
+    torch.save(state_dict, tmp_path)
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+def _load_sam(model_type, checkpoint_path, device):
+    # mmap only pays off on the cpu: moving to an accelerator copies anyway
+    if SAM_MMAP and device == "cpu":
+        try:
+            return load_sam_mmap(model_type, checkpoint_path), True
+        except RuntimeError as e:
+            print(f"Could not memory-map {checkpoint_path} ({e}); loading normally. "
+                  f"model_registry.convert_checkpoint can produce a mappable copy.")
+    model = sam_model_registry[model_type](checkpoint=checkpoint_path)
+    return model, False
+
+
+def _state_bytes(value):
+    # Dynamically quantized layers store (int8 weight, bias) tuples under _packed_params
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_state_bytes(item) for item in value)
+    return 0
+
+
+def _model_key(model_type, checkpoint_path, device, quantize):
+    return (model_type, os.path.abspath(checkpoint_path), device, quantize)
+
+
+def get_sam_model(model_type=None, checkpoint_path=None, device=None, quantize=None):
+    """
+    Return the shared SAM model for the given configuration, loading it on first use.
+
+    Args:
+        model_type: SAM backbone name ("vit_h", "vit_l" or "vit_b"); defaults to SAM_MODEL_TYPE
+        checkpoint_path: Path to the model checkpoint; defaults to the backbone's official file
+        device: Torch device; defaults to cuda when available, otherwise cpu
+        quantize: "none" or "int8"; defaults to SAM_QUANTIZE
+
+    Returns:
+        The loaded SAM model in eval mode
+    """
+    model_type, checkpoint_path, quantize = sam_backend(model_type, checkpoint_path, quantize)
+    device = device if device else default_device()
+    if quantize != "none" and device != "cpu":
+        raise ValueError("Dynamic quantization is only supported on the cpu device")
+    key = _model_key(model_type, checkpoint_path, device, quantize)
+
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _lock:
+        # Another thread may have finished loading while we waited for the lock
+        model = _models.get(key)
+        if model is not None:
+            return model
+
+        rss_before = _current_rss_bytes()
+        private_before = _private_rss_bytes()
+        start = time.perf_counter()
+        model, mmapped = _load_sam(model_type, checkpoint_path, device)
+        model.to(device=device)
+        model.eval()
+        if quantize == "int8":
+            quantize_image_encoder(model)
+        load_seconds = time.perf_counter() - start
+
+        # Quantized linear weights are packed buffers, not parameters, so count the state dict
+        param_bytes = sum(_state_bytes(value) for value in model.state_dict().values())
+        _models[key] = model
+        _stats[key] = {
+            "model_type": model_type,
+            "checkpoint_path": key[1],
+            "device": device,
+            "quantize": quantize,
+            "load_seconds": load_seconds,
+            "parameter_bytes": param_bytes,
+            "mmap": mmapped,
+            "rss_delta_bytes": max(_current_rss_bytes() - rss_before, 0),
+            # Private memory this process paid for the model; mmapped weights are shared
+            "private_rss_delta_bytes": max(_private_rss_bytes() - private_before, 0),
+            "loaded_at": time.time(),
+            "pid": os.getpid(),
+        }
+        stats = _stats[key]
+        print(f"Loaded SAM {model_type} ({quantize}) on {device} in {load_seconds:.2f}s"
+              f"{' via mmap' if mmapped else ''}: RSS +{stats['rss_delta_bytes'] / 2 ** 20:.0f} MB, "
+              f"private +{stats['private_rss_delta_bytes'] / 2 ** 20:.0f} MB")
+        return model
+
+
+def warm_up(model_type=None, checkpoint_path=None, device=None, quantize=None):
+    """
+    Load the model ahead of the first request (e.g. at app startup or before forking).
+    """
+    model_type, checkpoint_path, quantize = sam_backend(model_type, checkpoint_path, quantize)
+    if not os.path.exists(checkpoint_path):
+        print(f"SAM checkpoint not found at {checkpoint_path}, skipping warm-up")
+        return None
+    return get_sam_model(model_type, checkpoint_path, device, quantize)
+
+
+def registry_stats():
+    """
+    Return load time and memory figures for every model loaded in this process.
+    """
+    return {
+        "pid": os.getpid(),
+        "rss_bytes": _current_rss_bytes(),
+        "private_rss_bytes": _private_rss_bytes(),
+        "models": [dict(s) for s in _stats.values()],
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        print("Usage: python model_registry.py <checkpoint.pth> <converted.pth>")
+        sys.exit(1)
+    print(f"Wrote {convert_checkpoint(sys.argv[1], sys.argv[2])}")
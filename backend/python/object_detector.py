@@ -7,6 +7,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from PIL import Image
 from tqdm import tqdm
+from geometry import max_diameter
 def compute_green_percentage(image_bgr, lower_green=(35, 50, 50), upper_green=(85, 255, 255)):
     hsv = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV)
     green_mask = cv2.inRange(hsv, np.array(lower_green), np.array(upper_green))
@@ -57,22 +58,7 @@ def measure_longest_side(img):
     if coords.size == 0:
         return 0, None, None
     points = np.flip(coords, axis=1)  # (col, row) -> (x, y)
-    points_cv = points.astype(np.int32).reshape(-1, 1, 2)
-    hull = cv2.convexHull(points_cv)
-    if len(hull) < 2:
-        return 0, None, None
-    max_dist = 0
-    pt1 = pt2 = None
-    for i in range(len(hull)):
-        for j in range(i + 1, len(hull)):
-            p1 = tuple(hull[i][0])
-            p2 = tuple(hull[j][0])
-            d = math.hypot(p1[0] - p2[0], p1[1] - p2[1])
-            if d > max_dist:
-                max_dist = d
-                pt1 = p1
-                pt2 = p2
-    return max_dist, pt1, pt2
+    return max_diameter(points)
 
 def extract_marker_properties(folder_path, marker_physical_cm=28.0,
                               lower_green=(35, 50, 50), upper_green=(85, 255, 255),
@@ -101,6 +87,78 @@ def extract_marker_properties(folder_path, marker_physical_cm=28.0,
     return marker_filename, longest_side_px, conversion_factor
 
 
+def green_mask(image_bgr, lower_green=(35, 50, 50), upper_green=(85, 255, 255)):
+    """Boolean mask of green pixels, computed once for the whole image."""
+    hsv = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV)
+    return cv2.inRange(hsv, np.array(lower_green), np.array(upper_green)) > 0
+
+def find_marker_mask(image_bgr, masks, lower_green=(35, 50, 50), upper_green=(85, 255, 255)):
+    """
+    Pick the mask whose bbox crop has the highest green fraction, i.e. the same
+    score compute_green_percentage gives the mask's cutout, without any cutouts.
+
+    The green count of a whole bbox (from an integral image) bounds the count
+    inside its mask, so masks are visited by that bound and the search stops
+    once no remaining mask can beat the best exact fraction.
+
+    Args:
+        image_bgr: Segmented image in BGR order
+        masks: SAM annotations whose 'segmentation' is a CroppedMask
+
+    Returns:
+        (index into masks, green percentage), or (None, 0.0) if nothing is green
+    """
+    green = green_mask(image_bgr, lower_green, upper_green)
+    integral = cv2.integral(green.view(np.uint8))
+
+    segs = [ann['segmentation'] for ann in masks]
+    bboxes = np.array([seg.bbox for seg in segs], dtype=np.int64).reshape(-1, 4)
+    x0, y0, w, h = bboxes.T
+    x1, y1 = x0 + w, y0 + h
+    bbox_green = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    upper_bound = np.divide(bbox_green, w * h, out=np.zeros(len(segs)), where=w * h > 0) * 100
+
+    best_index, best_percentage = None, 0.0
+    for index in np.argsort(-upper_bound, kind="stable"):
+        if upper_bound[index] <= best_percentage:
+            break
+        seg = segs[index]
+        percentage = np.count_nonzero(green[seg.slices] & seg.mask) / seg.mask.size * 100
+        if percentage > best_percentage:
+            best_index, best_percentage = int(index), percentage
+    return best_index, best_percentage
+
+def extract_marker_properties_from_masks(image_bgr, masks, marker_physical_cm=28.0,
+                                         lower_green=(35, 50, 50), upper_green=(85, 255, 255),
+                                         white_threshold=240):
+    """
+    In-memory equivalent of extract_marker_properties: works on the segmented
+    image and its masks directly instead of rescanning a cutout folder.
+
+    Returns:
+        (marker mask index, longest side in pixels, conversion factor in cm/px)
+    """
+    marker_index, _ = find_marker_mask(image_bgr, masks, lower_green, upper_green)
+    if marker_index is None:
+        raise ValueError("No marker image found based on green detection.")
+
+    # Marker pixels are its mask minus near-white pixels, which the cutout-based
+    # path turned transparent
+    seg = masks[marker_index]['segmentation']
+    crop = image_bgr[seg.slices]
+    white = np.all(crop > white_threshold, axis=2)
+    rows, cols = np.nonzero(seg.mask & ~white)
+    if rows.size == 0:
+        raise ValueError("Could not measure the longest side in the marker image.")
+    points = np.column_stack((cols + seg.x, rows + seg.y))
+
+    longest_side_px, pt1, pt2 = max_diameter(points)
+    if longest_side_px == 0 or pt1 is None or pt2 is None:
+        raise ValueError("Could not measure the longest side in the marker image.")
+
+    conversion_factor = marker_physical_cm / longest_side_px
+    return marker_index, longest_side_px, conversion_factor
+
 # Example usage:
 if __name__ == "__main__":
     folder = "frag-temp"  # Replace with your folder path as needed.
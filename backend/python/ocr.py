@@ -1,6 +1,7 @@
-from OCR_Helper import ocr_pipeline, parse, parse_and_merge, write_to_json
+from OCR_Helper import ocr_pipeline, ocr_pipeline_array, parse, parse_and_merge, write_to_json, results_to_dict
 import shutil
 import os 
+import tempfile
 from pathlib import Path
 
 def OCR(image_path, temp_folder='temp_ocr', output_folder='output_ocr'):
@@ -9,7 +10,7 @@ def OCR(image_path, temp_folder='temp_ocr', output_folder='output_ocr'):
     
     Args:
         image_path: Path to the input image
-        temp_folder: Folder for temporary files
+        temp_folder: Parent folder for this call's private workspace
         output_folder: Folder for output files
         
     Returns:
@@ -18,10 +19,13 @@ def OCR(image_path, temp_folder='temp_ocr', output_folder='output_ocr'):
     # Create output directories
     os.makedirs(temp_folder, exist_ok=True)
     os.makedirs(output_folder, exist_ok=True)
+    
+    # Private workspace so concurrent calls never share intermediate files
+    workspace = tempfile.mkdtemp(prefix=f"{Path(image_path).stem}_", dir=temp_folder)
 
     try:
         # Run OCR pipeline on the image
-        results = ocr_pipeline(image_path, temp_folder)
+        results = ocr_pipeline(image_path, workspace)
         
         if not results:
             print(f"No results found for image: {image_path}")
@@ -48,13 +52,38 @@ def OCR(image_path, temp_folder='temp_ocr', output_folder='output_ocr'):
         print(f"Error in OCR process: {e}")
         
     finally:
-        # Uncomment to clean up temporary files
-        if os.path.exists(temp_folder):
-            shutil.rmtree(temp_folder)
-            print(f"Deleted temp folder: {temp_folder}")
+        # Clean up this call's temporary files only
+        if os.path.exists(workspace):
+            shutil.rmtree(workspace)
+            print(f"Deleted workspace: {workspace}")
         pass
  
 
+def OCR_from_array(image):
+    """
+    In-memory OCR: run the pipeline on a decoded image and return the parsed result.
+    
+    Args:
+        image: BGR image (numpy array)
+        
+    Returns:
+        Numbered dict of parsed values (same content as the JSON written by OCR),
+        or None if nothing was recognized
+    """
+    results = ocr_pipeline_array(image)
+    
+    if not results:
+        print("No results found for image")
+        return None
+    
+    # Results are already in line order
+    result_list = list(results.values())
+    parsed_results = parse(result_list)
+    length, merged_results = parse_and_merge(parsed_results)
+    print(f"Parsed results: {merged_results}")
+    return results_to_dict(merged_results)
+
+
 # Example usage
 # Outputnya bakal kesimpen di "output_ocr/{nama img}.json"
 # if __name__ == "__main__":
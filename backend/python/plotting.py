@@ -0,0 +1,118 @@
+import io
+import math
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from metrics import timed
+
+# Output formats accepted by render_combined_plot: format -> (file extension, content type)
+PLOT_FORMATS = {
+    "png": ("png", "image/png"),
+    "svg": ("svg", "image/svg+xml"),
+}
+DEFAULT_PLOT_DPI = 300
+MIN_PLOT_DPI = 50
+MAX_PLOT_DPI = 300
+
+# Percentile markers drawn on the Kuz-Ram curve: (key, color, linestyle)
+_MARKERS = [
+    ("P10", "green", "--"),
+    ("P20", "cyan", "--"),
+    ("P80", "purple", "--"),
+    ("P90", "orange", "--"),
+    ("X50", "magenta", "-."),
+]
+
+
+def plot_series(kuzram_data, measurements_pixels, conversion):
+    """
+    Raw data behind the combined plot, for clients that draw the chart themselves.
+
+    Returns:
+        dict with the Kuz-Ram curve, the percentile markers (cm) and the measured
+        size CDF (cm / %); the first measurement is excluded as in the rendered plot.
+    """
+    series = {
+        "kuzram": {
+            "sizes": np.asarray(kuzram_data["sizes"]).tolist(),
+            "distribution": np.asarray(kuzram_data["distribution"]).tolist(),
+        },
+        "markers": {key: (float(kuzram_data[key]) if kuzram_data[key] is not None else None)
+                    for key, _, _ in _MARKERS},
+        "cdf": {"sizes": [], "cumulative_percentage": []},
+    }
+    if len(measurements_pixels) > 1:
+        sorted_meas = np.sort(np.asarray(measurements_pixels[1:], dtype=np.float64) * conversion)
+        n_points = len(sorted_meas)
+        series["cdf"] = {
+            "sizes": sorted_meas.tolist(),
+            "cumulative_percentage": (np.arange(1, n_points + 1) / n_points * 100).tolist(),
+        }
+    return series
+
+
+def build_combined_figure(kuzram_data, measurements_pixels, conversion):
+    """
+    Build the combined Kuz-Ram / CDF chart on its own Figure.
+
+    The figure is not registered with pyplot, so concurrent requests never share
+    plotting state and nothing needs to be closed afterwards.
+    """
+    fig = Figure(figsize=(10, 8))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+
+    ax.plot(kuzram_data["sizes"], kuzram_data["distribution"],
+            label=f"Kuz-Ram Distribution\nX50 = {kuzram_data['X50']:.2f} cm", linestyle='-', color='blue')
+    for key, color, linestyle in _MARKERS:
+        if kuzram_data[key] is not None:
+            ax.axvline(kuzram_data[key], color=color, linestyle=linestyle, label=f'{key} = {kuzram_data[key]:.2f} cm')
+
+    cdf = plot_series(kuzram_data, measurements_pixels, conversion)["cdf"]
+    if cdf["sizes"]:
+        ax.plot(cdf["sizes"], cdf["cumulative_percentage"], marker='o', linestyle='-',
+                label="CDF of Object Sizes", color='red')
+
+    ax.set_xlabel("Size (cm)")
+    ax.set_ylabel("Cumulative Percentage (%)")
+    ax.set_title("Combined Kuz-Ram Distribution and CDF")
+    ax.grid(True)
+    ax.legend(loc='best')
+    return fig
+
+
+def clamp_dpi(dpi):
+    """
+    DPI from user input (e.g. a form string), clamped to the allowed range.
+
+    Raises:
+        ValueError: if the value is not a finite number
+    """
+    try:
+        value = float(dpi)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid plot_dpi: {dpi}") from None
+    if not math.isfinite(value):
+        raise ValueError(f"Invalid plot_dpi: {dpi}")
+    return int(min(max(int(value), MIN_PLOT_DPI), MAX_PLOT_DPI))
+
+
+@timed("plotting")
+def render_combined_plot(kuzram_data, measurements_pixels, conversion, fmt="png", dpi=DEFAULT_PLOT_DPI):
+    """
+    Render the combined plot to bytes. Safe to call from many threads at once.
+
+    Args:
+        fmt: "png" or "svg" (see PLOT_FORMATS)
+        dpi: Resolution for PNG output, clamped to [MIN_PLOT_DPI, MAX_PLOT_DPI]
+
+    Returns:
+        bytes of the encoded image
+    """
+    if fmt not in PLOT_FORMATS:
+        raise ValueError(f"Unsupported plot format: {fmt}")
+    fig = build_combined_figure(kuzram_data, measurements_pixels, conversion)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, dpi=clamp_dpi(dpi))
+    return buffer.getvalue()
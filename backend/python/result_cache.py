@@ -0,0 +1,196 @@
+import os
+import sys
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Default in-memory budget per tier, in megabytes (override with RESULT_CACHE_<TIER>_MB)
+DEFAULT_TIER_MB = {
+    "sam_masks": 512,
+    "sam_embeddings": 256,
+    "measurements": 128,
+    "marker": 8,
+    "ocr": 16,
+}
+# Optional on-disk tier shared by all workers on the host
+CACHE_DIR = os.environ.get("RESULT_CACHE_DIR")
+DEFAULT_DISK_MB = int(os.environ.get("RESULT_CACHE_DISK_MB", 2048))
+
+
+def content_hash(data):
+    """SHA-256 hex digest of raw upload bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(*parts):
+    """Stable cache key from an image hash plus the parameters a result depends on."""
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+def estimate_size(value):
+    """Approximate memory footprint of a cached value in bytes."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+class ByteLRUCache:
+    """
+    Thread-safe LRU cache bounded by the total estimated size of its values,
+    optionally backed by a directory of pickles that survives restarts and is
+    shared between worker processes.
+    """
+
+    def __init__(self, name, max_bytes, disk_dir=None, max_disk_bytes=DEFAULT_DISK_MB * 1024 * 1024):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    value = pickle.load(f)
+                os.utime(path)  # mark as recently used for disk eviction
+            except (OSError, pickle.PickleError, EOFError):
+                value = None
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._put_memory(key, value, estimate_size(value))
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value, size=None):
+        size = estimate_size(value) if size is None else size
+        self._put_memory(key, value, size)
+        if self.disk_dir:
+            self._put_disk(key, value)
+
+    def _put_memory(self, key, value, size):
+        # Values larger than the whole budget are not worth evicting everything for
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def _put_disk(self, key, value):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write {self.name} cache entry to disk: {e}")
+            return
+        self._trim_disk()
+
+    def _trim_disk(self):
+        try:
+            files = [os.path.join(self.disk_dir, f) for f in os.listdir(self.disk_dir) if f.endswith(".pkl")]
+            stats = [(os.path.getmtime(f), os.path.getsize(f), f) for f in files]
+        except OSError:
+            return
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_dir": self.disk_dir,
+            }
+
+
+class ResultCache:
+    """
+    Content-addressed cache for expensive pipeline results, one tier per kind:
+    SAM masks, SAM image embeddings, fragment measurements, marker conversion
+    factors and OCR results.
+    """
+
+    def __init__(self, tier_mb=None, disk_dir=CACHE_DIR):
+        tier_mb = dict(DEFAULT_TIER_MB, **(tier_mb or {}))
+        self.tiers = {}
+        for name, mb in tier_mb.items():
+            mb = float(os.environ.get(f"RESULT_CACHE_{name.upper()}_MB", mb))
+            tier_dir = os.path.join(disk_dir, name) if disk_dir else None
+            self.tiers[name] = ByteLRUCache(name, int(mb * 1024 * 1024), tier_dir)
+
+    def tier(self, name):
+        return self.tiers[name]
+
+    def stats(self):
+        return {name: tier.stats() for name, tier in self.tiers.items()}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the process-wide result cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
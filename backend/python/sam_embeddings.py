@@ -0,0 +1,57 @@
+import hashlib
+
+import numpy as np
+import torch
+from segment_anything import SamPredictor
+
+from result_cache import get_result_cache, make_key
+from metrics import span, timed
+
+
+def image_fingerprint(image, image_format="RGB"):
+    """Content hash of the exact pixels handed to the image encoder."""
+    data = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(data.data, digest_size=16)
+    digest.update(repr((data.shape, data.dtype.str, image_format)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CachedEmbeddingPredictor(SamPredictor):
+    """
+    SamPredictor whose image embedding is looked up in the result cache before
+    running the ViT encoder.
+
+    Re-segmenting a photo with different generator settings, or refining it with
+    point/box prompts, then only reruns the lightweight mask decoder. Entries are
+    keyed by the content of the image passed to set_image (which for crop layers
+    and tiles is the crop, not the upload) and by the model.
+    """
+
+    def __init__(self, sam_model, model_key, cache=None):
+        super().__init__(sam_model)
+        self.model_key = model_key
+        self.cache = cache if cache is not None else get_result_cache().tier("sam_embeddings")
+
+    def set_image(self, image, image_format="RGB"):
+        key = make_key(image_fingerprint(image, image_format), self.model_key)
+        entry = self.cache.get(key)
+        if entry is None:
+            with span("sam_encode"):
+                super().set_image(image, image_format)
+            self.cache.put(key, {
+                "features": self.features.detach().cpu().numpy(),
+                "original_size": tuple(self.original_size),
+                "input_size": tuple(self.input_size),
+            })
+            return
+
+        # Restore exactly the state set_torch_image would have left behind
+        self.reset_image()
+        self.features = torch.from_numpy(entry["features"]).to(self.device)
+        self.original_size = tuple(entry["original_size"])
+        self.input_size = tuple(entry["input_size"])
+        self.is_image_set = True
+
+    @timed("sam_decode")
+    def predict_torch(self, *args, **kwargs):
+        return super().predict_torch(*args, **kwargs)
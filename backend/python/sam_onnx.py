@@ -0,0 +1,305 @@
+import os
+import fcntl
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+from segment_anything.utils.onnx import SamOnnxModel
+
+from sam_embeddings import CachedEmbeddingPredictor
+from metrics import timed
+from model_registry import sam_backend
+
+try:
+    import onnxruntime as ort
+except ImportError:  # optional dependency, only needed for SAM_RUNTIME=onnx
+    ort = None
+
+# "torch" runs SAM eagerly; "onnx" runs exported graphs with ONNX Runtime on CPU
+SAM_RUNTIME = os.environ.get("SAM_RUNTIME", "torch").lower()
+RUNTIMES = ("torch", "onnx")
+# Where exported graphs are kept; export happens once per model
+SAM_ONNX_DIR = os.environ.get("SAM_ONNX_DIR", "onnx_models")
+# Threads per ONNX Runtime session (0 lets ORT decide)
+SAM_ONNX_THREADS = int(os.environ.get("SAM_ONNX_THREADS", 0))
+ONNX_OPSET = 17
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class _ImageEncoder(torch.nn.Module):
+    """Export wrapper: normalized, padded 1x3x1024x1024 image -> 1x256x64x64 embedding."""
+
+    def __init__(self, sam):
+        super().__init__()
+        self.image_encoder = sam.image_encoder
+
+    def forward(self, image):
+        return self.image_encoder(image)
+
+
+class _MaskDecoder(torch.nn.Module):
+    """
+    Export wrapper around SamOnnxModel's prompt embedding and mask prediction,
+    returning low-resolution logits for all four mask tokens.
+
+    Upscaling to the original image size is left to the caller: SamOnnxModel
+    traces the crop to the pre-padded size as a constant of the export image
+    size, and upscaling every token inside the graph would waste most of the work.
+    """
+
+    def __init__(self, sam):
+        super().__init__()
+        self.onnx_model = SamOnnxModel(sam, return_single_mask=False)
+
+    def forward(self, image_embeddings, point_coords, point_labels, mask_input, has_mask_input):
+        model = self.onnx_model
+        sparse_embedding = model._embed_points(point_coords, point_labels)
+        dense_embedding = model._embed_masks(mask_input, has_mask_input)
+        low_res_masks, iou_predictions = model.mask_decoder.predict_masks(
+            image_embeddings=image_embeddings,
+            image_pe=model.model.prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse_embedding,
+            dense_prompt_embeddings=dense_embedding,
+        )
+        return low_res_masks, iou_predictions
+
+
+def resolve_runtime(runtime):
+    runtime = (runtime or SAM_RUNTIME).lower()
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown SAM runtime '{runtime}', expected one of: {', '.join(RUNTIMES)}")
+    if runtime == "onnx" and ort is None:
+        raise ImportError("SAM_RUNTIME=onnx requires the onnxruntime package")
+    return runtime
+
+
+def onnx_model_name(model_key):
+    """File-name stem for a model's exported graphs, e.g. 'sam_vit_h_4b8939'."""
+    model_type, checkpoint_name = model_key[:2]
+    return os.path.splitext(checkpoint_name)[0] or model_type
+
+
+def onnx_paths(model_name, output_dir=SAM_ONNX_DIR):
+    """(encoder path, decoder path) of the exported graphs for a model."""
+    return (os.path.join(output_dir, f"{model_name}_encoder.onnx"),
+            os.path.join(output_dir, f"{model_name}_decoder.onnx"))
+
+
+@contextmanager
+def _export_lock(model_name, output_dir):
+    # Serializes exports across processes: workers, job workers and the master
+    # may all find the graphs missing at the same time
+    with open(os.path.join(output_dir, f"{model_name}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _export_atomic(export, path):
+    """
+    Run export(tmp_path) in a scratch directory next to `path`, then move the result
+    into place. The graph is renamed last, so its presence means a complete export
+    and a crash never leaves a truncated graph behind.
+    """
+    output_dir = os.path.dirname(path) or "."
+    scratch = tempfile.mkdtemp(prefix=".export_", dir=output_dir)
+    try:
+        tmp_path = os.path.join(scratch, os.path.basename(path))
+        export(tmp_path)
+        # Weights above 2 GB (vit_h) are written as external data files next to the graph
+        for filename in os.listdir(scratch):
+            if filename != os.path.basename(path):
+                os.replace(os.path.join(scratch, filename), os.path.join(output_dir, filename))
+        os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+@torch.no_grad()
+def export_sam_onnx(sam, model_name, output_dir=SAM_ONNX_DIR):
+    """
+    Export the image encoder and the prompt/mask decoder of a loaded SAM model.
+
+    The decoder is SamOnnxModel with return_single_mask=False, so it returns all
+    four mask tokens (index 0 is the single-mask output, 1: the multimask outputs),
+    exported with dynamic prompt-batch and point-count axes so one run decodes a
+    whole batch of point prompts as the automatic mask generator issues them.
+
+    Exports hold a file lock and are renamed into place when complete, so
+    concurrent processes export once and never load a partial graph.
+
+    Returns:
+        (encoder path, decoder path)
+    """
+    encoder_path, decoder_path = onnx_paths(model_name, output_dir)
+    if os.path.exists(encoder_path) and os.path.exists(decoder_path):
+        return encoder_path, decoder_path
+    os.makedirs(output_dir, exist_ok=True)
+    img_size = sam.image_encoder.img_size
+
+    def export_encoder(path):
+        torch.onnx.export(_ImageEncoder(sam).eval(), torch.randn(1, 3, img_size, img_size), path,
+                          input_names=["image"], output_names=["image_embeddings"],
+                          opset_version=ONNX_OPSET, do_constant_folding=True, dynamo=False)
+
+    def export_decoder(path):
+        decoder = _MaskDecoder(sam).eval()
+        embed_dim = sam.prompt_encoder.embed_dim
+        embed_size = sam.prompt_encoder.image_embedding_size
+        mask_input_size = [4 * x for x in embed_size]
+        dummy_inputs = {
+            "image_embeddings": torch.randn(1, embed_dim, *embed_size, dtype=torch.float),
+            "point_coords": torch.randint(low=0, high=img_size, size=(2, 5, 2), dtype=torch.float),
+            "point_labels": torch.randint(low=0, high=4, size=(2, 5), dtype=torch.float),
+            "mask_input": torch.randn(1, 1, *mask_input_size, dtype=torch.float),
+            "has_mask_input": torch.tensor([0], dtype=torch.float),
+        }
+        torch.onnx.export(decoder, tuple(dummy_inputs.values()), path,
+                          input_names=list(dummy_inputs), output_names=["low_res_masks", "iou_predictions"],
+                          dynamic_axes={
+                              "point_coords": {0: "batch", 1: "num_points"},
+                              "point_labels": {0: "batch", 1: "num_points"},
+                              "mask_input": {0: "mask_batch"},
+                          },
+                          opset_version=ONNX_OPSET, do_constant_folding=True, dynamo=False)
+
+    with _export_lock(model_name, output_dir):
+        # Another process may have finished the export while we waited
+        if not os.path.exists(encoder_path):
+            print(f"Exporting SAM image encoder to {encoder_path}")
+            _export_atomic(export_encoder, encoder_path)
+        if not os.path.exists(decoder_path):
+            print(f"Exporting SAM mask decoder to {decoder_path}")
+            _export_atomic(export_decoder, decoder_path)
+    return encoder_path, decoder_path
+
+
+def _session(path, threads=SAM_ONNX_THREADS):
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # The arena would keep the encoder's attention buffers (GBs) and the largest
+    # prompt batch's buffers allocated between requests
+    options.enable_cpu_mem_arena = False
+    if threads:
+        options.intra_op_num_threads = threads
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def get_onnx_sessions(sam, model_name, output_dir=SAM_ONNX_DIR):
+    """
+    Return the shared (encoder, decoder) ONNX Runtime sessions for a model,
+    exporting the graphs first if they are not on disk yet.
+    """
+    key = (model_name, os.path.abspath(output_dir))
+    sessions = _sessions.get(key)
+    if sessions is None:
+        with _sessions_lock:
+            sessions = _sessions.get(key)
+            if sessions is None:
+                encoder_path, decoder_path = export_sam_onnx(sam, model_name, output_dir)
+                sessions = (_session(encoder_path), _session(decoder_path))
+                _sessions[key] = sessions
+    return sessions
+
+
+def warm_up(sam, runtime=None):
+    """
+    Export the configured model's graphs if needed and open this process's
+    sessions ahead of the first request. No-op unless the ONNX runtime is
+    selected (SAM_RUNTIME=onnx) and the model was loaded.
+
+    ONNX Runtime sessions do not survive a fork (their thread pools stay in the
+    parent), so call this in the process that will run inference.
+
+    Args:
+        sam: Model returned by model_registry.warm_up, or None
+        runtime: "torch" or "onnx"; defaults to SAM_RUNTIME
+
+    Returns:
+        (encoder session, decoder session), or None
+    """
+    model_type, checkpoint_path, quantize = sam_backend()
+    if sam is None or quantize != "none" or resolve_runtime(runtime) != "onnx":
+        return None
+    model_name = onnx_model_name((model_type, os.path.basename(checkpoint_path)))
+    return get_onnx_sessions(sam, model_name)
+
+
+class OnnxSamPredictor(CachedEmbeddingPredictor):
+    """
+    Drop-in SamPredictor running the encoder and decoder through ONNX Runtime.
+
+    Image transforms, normalization and prompt coordinates are handled exactly as
+    in SamPredictor, so SamAutomaticMaskGenerator produces the same annotation
+    format; embeddings still go through the embedding cache.
+    """
+
+    def __init__(self, sam_model, sessions, model_key, cache=None):
+        super().__init__(sam_model, model_key, cache)
+        self.encoder_session, self.decoder_session = sessions
+
+    @torch.no_grad()
+    def set_torch_image(self, transformed_image, original_image_size):
+        self.reset_image()
+        self.original_size = original_image_size
+        self.input_size = tuple(transformed_image.shape[-2:])
+        input_image = self.model.preprocess(transformed_image).cpu().numpy().astype(np.float32)
+        embeddings = self.encoder_session.run(None, {"image": input_image})[0]
+        self.features = torch.from_numpy(embeddings)
+        self.is_image_set = True
+
+    @timed("sam_decode")
+    @torch.no_grad()
+    def predict_torch(self, point_coords, point_labels, boxes=None, mask_input=None,
+                      multimask_output=True, return_logits=False):
+        if not self.is_image_set:
+            raise RuntimeError("An image must be set with .set_image(...) before mask prediction.")
+
+        coords, labels = [], []
+        if point_coords is not None:
+            coords.append(point_coords.float())
+            labels.append(point_labels.float())
+        if boxes is not None:
+            # Box corners are prompts with labels 2 (top-left) and 3 (bottom-right)
+            corners = boxes.reshape(-1, 2, 2).float()
+            coords.append(corners)
+            labels.append(torch.tensor([2.0, 3.0]).expand(corners.shape[0], 2))
+        else:
+            # Without a box the prompt encoder pads with a "not a point" entry
+            batch = coords[0].shape[0]
+            coords.append(torch.zeros(batch, 1, 2))
+            labels.append(-torch.ones(batch, 1))
+        coords = torch.cat(coords, dim=1)
+        labels = torch.cat(labels, dim=1)
+
+        if mask_input is None:
+            mask_input = torch.zeros(1, 1, *[4 * x for x in self.model.prompt_encoder.image_embedding_size])
+            has_mask_input = np.zeros(1, dtype=np.float32)
+        else:
+            has_mask_input = np.ones(1, dtype=np.float32)
+
+        low_res_masks, iou_predictions = self.decoder_session.run(None, {
+            "image_embeddings": self.features.cpu().numpy(),
+            "point_coords": coords.cpu().numpy(),
+            "point_labels": labels.cpu().numpy(),
+            "mask_input": mask_input.float().cpu().numpy(),
+            "has_mask_input": has_mask_input,
+        })
+
+        # Token 0 is the single-mask output, tokens 1: the three multimask outputs
+        selected = slice(1, None) if multimask_output else slice(0, 1)
+        iou_predictions = torch.from_numpy(iou_predictions[:, selected]).to(self.device)
+        low_res_masks = torch.from_numpy(low_res_masks[:, selected]).to(self.device)
+
+        # Upscale the selected masks exactly as SamPredictor does
+        masks = self.model.postprocess_masks(low_res_masks, self.input_size, self.original_size)
+        if not return_logits:
+            masks = masks > self.model.mask_threshold
+        return masks, iou_predictions, low_res_masks
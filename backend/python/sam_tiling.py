@@ -0,0 +1,221 @@
+import os
+
+import cv2
+import numpy as np
+
+from mask_codec import compact_masks, overlap_area, union_masks
+
+# Longest side SAM works on; larger photos are downscaled first (0 = full resolution)
+SAM_MAX_SIDE = int(os.environ.get("SAM_MAX_SIDE", 0))
+# Tile edge at working resolution; larger images are split into tiles (0 = no tiling)
+SAM_TILE_SIZE = int(os.environ.get("SAM_TILE_SIZE", 0))
+# Pixels shared by neighbouring tiles, so most fragments appear whole in one tile
+SAM_TILE_OVERLAP = int(os.environ.get("SAM_TILE_OVERLAP", 256))
+
+# Masks from different tiles with at least this mask IoU are the same object
+DUPLICATE_IOU = 0.7
+# Edge-cut pieces sharing at least this fraction of the smaller piece are joined
+JOIN_OVERLAP = 0.5
+# Edge-cut pieces covered this much by a complete mask are dropped
+COVERED_FRACTION = 0.7
+
+
+def check_tiling(tile_size, overlap):
+    """
+    Raise ValueError for tiling settings that cannot work: an overlap as large as
+    the tile would step one pixel at a time, i.e. a full SAM pass per pixel.
+    """
+    if tile_size < 0 or overlap < 0:
+        raise ValueError(f"Tile size and overlap must not be negative (got {tile_size}, {overlap})")
+    if tile_size and overlap >= tile_size:
+        raise ValueError(f"SAM tile overlap ({overlap}) must be smaller than the tile size ({tile_size})")
+
+
+check_tiling(SAM_TILE_SIZE, SAM_TILE_OVERLAP)
+
+
+def working_scale(image_shape, max_side):
+    """Scale factor (<= 1) that brings the image's longest side down to max_side."""
+    longest = max(image_shape[:2])
+    if not max_side or longest <= max_side:
+        return 1.0
+    return max_side / longest
+
+
+def downscale(image, max_side):
+    """Return the image resized for inference (or the image itself when small enough)."""
+    scale = working_scale(image.shape, max_side)
+    if scale >= 1.0:
+        return image
+    height, width = image.shape[:2]
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def _tile_starts(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def tile_boxes(width, height, tile_size, overlap):
+    """(x0, y0, x1, y1) tiles covering the image with the given overlap."""
+    check_tiling(tile_size, overlap)
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in _tile_starts(height, tile_size, overlap)
+            for x in _tile_starts(width, tile_size, overlap)]
+
+
+def _touches_interior_edge(seg, tile, width, height):
+    # Only tile edges inside the image cut objects; the image border does not
+    x, y, w, h = seg.bbox
+    x0, y0, x1, y1 = tile
+    return ((x == x0 and x0 > 0) or (y == y0 and y0 > 0) or
+            (x + w == x1 and x1 < width) or (y + h == y1 and y1 < height))
+
+
+def _candidate_pairs(segs):
+    """Index pairs (i < j) whose bounding boxes intersect."""
+    if len(segs) < 2:
+        return []
+    boxes = np.array([seg.bbox for seg in segs], dtype=np.int64)
+    x0, y0 = boxes[:, 0], boxes[:, 1]
+    x1, y1 = x0 + boxes[:, 2], y0 + boxes[:, 3]
+    hit = ((x0[:, None] < x1[None, :]) & (x0[None, :] < x1[:, None]) &
+           (y0[:, None] < y1[None, :]) & (y0[None, :] < y1[:, None]))
+    i, j = np.nonzero(np.triu(hit, k=1))
+    return list(zip(i.tolist(), j.tolist()))
+
+
+def _annotation(seg, sources):
+    # Merged annotation keeps the scores of its best-scoring source
+    best = max(sources, key=lambda ann: ann.get("predicted_iou", 0.0))
+    ann = dict(best)
+    ann["segmentation"] = seg
+    ann["area"] = seg.area
+    ann["bbox"] = list(seg.bbox)
+    return ann
+
+
+def merge_tile_masks(complete, partial):
+    """
+    Merge masks gathered from overlapping tiles into one set for the whole image.
+
+    Complete masks (not cut by an interior tile edge) are deduplicated by mask IoU,
+    keeping the higher predicted_iou. Edge-cut pieces are joined across tiles when
+    they overlap, then dropped if a complete mask already covers them.
+
+    Args:
+        complete: Annotations in image coordinates not touching an interior tile edge
+        partial: Annotations in image coordinates cut by an interior tile edge
+
+    Returns:
+        Merged annotations with CroppedMask segmentations
+    """
+    # Deduplicate complete masks, best-scored first
+    complete = sorted(complete, key=lambda ann: ann.get("predicted_iou", 0.0), reverse=True)
+    segs = [ann["segmentation"] for ann in complete]
+    areas = [seg.area for seg in segs]
+    dropped = set()
+    for i, j in _candidate_pairs(segs):
+        if i in dropped or j in dropped:
+            continue
+        inter = overlap_area(segs[i], segs[j])
+        if inter and inter / (areas[i] + areas[j] - inter) >= DUPLICATE_IOU:
+            dropped.add(j)
+    kept = [ann for index, ann in enumerate(complete) if index not in dropped]
+
+    # Join edge-cut pieces of the same object with union-find
+    parts = [ann["segmentation"] for ann in partial]
+    parent = list(range(len(parts)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    part_areas = [seg.area for seg in parts]
+    for i, j in _candidate_pairs(parts):
+        inter = overlap_area(parts[i], parts[j])
+        if inter and inter / max(min(part_areas[i], part_areas[j]), 1) >= JOIN_OVERLAP:
+            parent[find(i)] = find(j)
+
+    groups = {}
+    for index in range(len(parts)):
+        groups.setdefault(find(index), []).append(index)
+
+    kept_segs = [ann["segmentation"] for ann in kept]
+    for members in groups.values():
+        seg = union_masks([parts[index] for index in members])
+        area = seg.area
+        if any(overlap_area(seg, other) >= COVERED_FRACTION * area for other in kept_segs):
+            continue
+        kept.append(_annotation(seg, [partial[index] for index in members]))
+    return kept
+
+
+def generate_tiled(generate, image, tile_size, overlap):
+    """
+    Run mask generation tile by tile and merge the results.
+
+    Args:
+        generate: Callable(image) -> SAM annotations for one tile
+        image: RGB image at working resolution
+        tile_size: Tile edge in pixels
+        overlap: Pixels shared by neighbouring tiles
+
+    Returns:
+        Annotations with CroppedMask segmentations in image coordinates
+    """
+    height, width = image.shape[:2]
+    complete, partial = [], []
+    for tile in tile_boxes(width, height, tile_size, overlap):
+        x0, y0, x1, y1 = tile
+        anns = compact_masks(generate(np.ascontiguousarray(image[y0:y1, x0:x1])))
+        for ann in anns:
+            seg = ann["segmentation"].translate(x0, y0, (height, width))
+            if seg.mask.size == 0:
+                continue
+            ann["segmentation"] = seg
+            ann["bbox"] = list(seg.bbox)
+            if "point_coords" in ann:
+                ann["point_coords"] = [[px + x0, py + y0] for px, py in ann["point_coords"]]
+            if "crop_box" in ann:
+                cx, cy, cw, ch = ann["crop_box"]
+                ann["crop_box"] = [cx + x0, cy + y0, cw, ch]
+            (partial if _touches_interior_edge(seg, tile, width, height) else complete).append(ann)
+    print(f"Tiled segmentation: {len(complete)} complete and {len(partial)} edge-cut masks")
+    return merge_tile_masks(complete, partial)
+
+
+def rescale_annotations(anns, image_shape):
+    """
+    Bring annotations from the working resolution back to the original pixel grid,
+    so areas, bboxes and everything measured on them are in original pixels.
+
+    Args:
+        anns: Annotations with CroppedMask segmentations at working resolution
+        image_shape: Shape of the original image
+
+    Returns:
+        The same list, updated in place
+    """
+    height, width = image_shape[:2]
+    for ann in anns:
+        seg = ann["segmentation"]
+        sx, sy = width / seg.image_shape[1], height / seg.image_shape[0]
+        seg = seg.rescale((height, width))
+        ann["segmentation"] = seg
+        ann["area"] = seg.area
+        ann["bbox"] = list(seg.bbox)
+        if "point_coords" in ann:
+            ann["point_coords"] = [[px * sx, py * sy] for px, py in ann["point_coords"]]
+        if "crop_box" in ann:
+            cx, cy, cw, ch = ann["crop_box"]
+            ann["crop_box"] = [int(round(cx * sx)), int(round(cy * sy)),
+                               int(round(cw * sx)), int(round(ch * sy))]
+    return anns
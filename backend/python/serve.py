@@ -0,0 +1,304 @@
+"""
+Production entry point: a prefork WSGI server for app.py.
+
+The master process binds the listening socket and forks the workers before any
+model is loaded: torch (OpenMP), ONNX Runtime and PaddleOCR start thread pools
+on first use, and a child forked after that can deadlock on a pool whose threads
+did not survive the fork. Each worker therefore loads its own models before it
+accepts requests; mmap-loaded SAM weights are still shared through the page
+cache, and ONNX graphs are exported once under a file lock (see sam_onnx).
+Every worker runs a threaded werkzeug server on the shared socket, with
+concurrency limited per endpoint class. Any worker may receive a follow-up
+request, so job and async plot-upload state is kept in SHARED_STATE_DIR (see
+shared_state) rather than in worker memory.
+
+Signals to the master:
+    SIGHUP           graceful reload: re-exec, start new workers and wait until they
+                     are warm, then let the old workers finish their in-flight
+                     requests and exit
+    SIGTERM / SIGINT graceful shutdown
+
+Usage:
+    python serve.py
+"""
+import os
+import sys
+import time
+import select
+import signal
+import socket
+import threading
+
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+
+import metrics
+
+SERVE_HOST = os.environ.get("SERVE_HOST", "127.0.0.1")
+SERVE_PORT = int(os.environ.get("SERVE_PORT", 5000))
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", 2))
+# Requests handled concurrently by one worker, across all endpoint classes
+SERVE_THREADS = int(os.environ.get("SERVE_THREADS", 8))
+# Concurrent requests per worker for each endpoint class (0 = only SERVE_THREADS applies)
+SERVE_LIMITS = {
+    "segmentation": int(os.environ.get("SERVE_LIMIT_SEGMENTATION", 1)),
+    "analysis": int(os.environ.get("SERVE_LIMIT_ANALYSIS", 4)),
+    "ocr": int(os.environ.get("SERVE_LIMIT_OCR", 2)),
+    "light": int(os.environ.get("SERVE_LIMIT_LIGHT", 0)),
+}
+# Seconds a request may wait for a free slot before getting 503
+SERVE_QUEUE_TIMEOUT = float(os.environ.get("SERVE_QUEUE_TIMEOUT", 30))
+# Workers load their models before accepting requests (0: serve right away and
+# warm up in the background; /ready reports when done)
+SERVE_PRELOAD = os.environ.get("SERVE_PRELOAD", "1").lower() in ("1", "true", "yes")
+# Seconds a reload waits for the new workers to warm up before stopping the old ones
+SERVE_WARM_UP_TIMEOUT = float(os.environ.get("SERVE_WARM_UP_TIMEOUT", 600))
+# Seconds old workers get to finish in-flight requests on reload/shutdown
+SERVE_GRACEFUL_TIMEOUT = float(os.environ.get("SERVE_GRACEFUL_TIMEOUT", 120))
+
+# Endpoint classes by path prefix; everything else is "light"
+ENDPOINT_CLASSES = (
+    ("/fragmentation-red-outline", "segmentation"),
+    # Contour measurement and plotting, no SAM: must not queue behind segmentations
+    ("/fragmentation-analysis", "analysis"),
+    ("/ocr", "ocr"),
+)
+
+# Handed over to the re-executed master on reload
+_LISTEN_FD_ENV = "SERVE_LISTEN_FD"
+_OLD_WORKERS_ENV = "SERVE_OLD_WORKERS"
+
+
+def endpoint_class(path):
+    for prefix, name in ENDPOINT_CLASSES:
+        if path == prefix or path.startswith(prefix + "/"):
+            return name
+    return "light"
+
+
+class ConcurrencyLimiter:
+    """
+    WSGI middleware bounding concurrent requests per endpoint class, so a burst
+    of segmentations cannot starve OCR or the status endpoints of threads.
+    """
+
+    def __init__(self, app, limits=SERVE_LIMITS, total=SERVE_THREADS, timeout=SERVE_QUEUE_TIMEOUT):
+        self.app = app
+        self.timeout = timeout
+        self.total = threading.BoundedSemaphore(total)
+        self.limits = {name: threading.BoundedSemaphore(limit) for name, limit in limits.items() if limit > 0}
+
+    def _busy(self, start_response):
+        body = b'{"error": "Server busy, retry later"}'
+        start_response("503 Service Unavailable", [("Content-Type", "application/json"),
+                                                   ("Content-Length", str(len(body))),
+                                                   ("Retry-After", "10")])
+        return [body]
+
+    def __call__(self, environ, start_response):
+        name = endpoint_class(environ.get("PATH_INFO", ""))
+        semaphores = [self.total]
+        limit = self.limits.get(name)
+        if limit is not None:
+            semaphores.insert(0, limit)
+
+        acquired = []
+        deadline = time.monotonic() + self.timeout
+        # Requests blocked here are the real request queue; /metrics reports them
+        metrics.add_gauge("serve_requests_waiting", 1, endpoint_class=name)
+        try:
+            for semaphore in semaphores:
+                if not semaphore.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                    for held in acquired:
+                        held.release()
+                    # Flask never sees this request, so count it here
+                    metrics.inc("serve_rejected_total", endpoint_class=name)
+                    return self._busy(start_response)
+                acquired.append(semaphore)
+        finally:
+            metrics.add_gauge("serve_requests_waiting", -1, endpoint_class=name)
+        metrics.add_gauge("serve_requests_in_flight", 1, endpoint_class=name)
+
+        def release():
+            metrics.add_gauge("serve_requests_in_flight", -1, endpoint_class=name)
+            for held in acquired:
+                held.release()
+
+        try:
+            return ClosingIterator(self.app(environ, start_response), [release])
+        except BaseException:
+            release()
+            raise
+
+
+def _listening_socket():
+    fd = os.environ.pop(_LISTEN_FD_ENV, None)
+    if fd is not None:
+        sock = socket.fromfd(int(fd), socket.AF_INET, socket.SOCK_STREAM)
+        os.close(int(fd))  # fromfd duplicated it
+        return sock
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((SERVE_HOST, SERVE_PORT))
+    sock.listen(128)
+    return sock
+
+
+def _report_ready(ready_fd):
+    if ready_fd is not None:
+        os.write(ready_fd, b".")
+        os.close(ready_fd)
+
+
+def _wait_ready(ready_fd, count, timeout=SERVE_WARM_UP_TIMEOUT):
+    """Wait until `count` workers reported ready (or exited); returns how many are ready."""
+    deadline = time.monotonic() + timeout
+    ready = 0
+    while ready < count:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([ready_fd], [], [], remaining)[0]:
+            break
+        data = os.read(ready_fd, 64)
+        if not data:
+            break  # every new worker reported or exited
+        ready += len(data)
+    return ready
+
+
+def _worker(sock, app, warm_up, ready_fd):
+    """Runs in a forked child: load the models, then serve requests until told to stop."""
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # Split the CPU between workers instead of every worker using all cores; set
+    # before warm-up so torch's pool is created at this size
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(max(1, (os.cpu_count() or 1) // SERVE_WORKERS))
+
+    if SERVE_PRELOAD:
+        start = time.perf_counter()
+        warm_up()
+        print(f"Worker {os.getpid()} loaded models in {time.perf_counter() - start:.1f}s")
+
+    server = make_server(SERVE_HOST, SERVE_PORT, ConcurrencyLimiter(app), threaded=True, fd=sock.fileno())
+    # Let in-flight requests finish when shutting down
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    if not SERVE_PRELOAD:
+        # Serve /health right away; /ready turns healthy once warm
+        threading.Thread(target=warm_up, daemon=True).start()
+
+    _report_ready(ready_fd)
+    print(f"Worker {os.getpid()} serving on {SERVE_HOST}:{server.port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        # os._exit skips the periodic flush; publish the final counts
+        metrics.flush()
+    os._exit(0)
+
+
+def _spawn(sock, app, warm_up, ready_fd=None):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _worker(sock, app, warm_up, ready_fd)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def _stop_workers(pids, timeout=SERVE_GRACEFUL_TIMEOUT):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + timeout
+    remaining = set(pids)
+    while remaining and time.monotonic() < deadline:
+        for pid in list(remaining):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                remaining.discard(pid)
+        time.sleep(0.1)
+    for pid in remaining:
+        print(f"Worker {pid} did not stop in {timeout:.0f}s, killing it")
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+
+def run(app, warm_up):
+    """
+    Start the prefork server for a WSGI app.
+
+    Args:
+        app: The WSGI application (Flask app)
+        warm_up: Callable loading the models, run in each worker after the fork
+                 (never in the master, see the module docstring)
+    """
+    sock = _listening_socket()
+    old_workers = [int(pid) for pid in os.environ.pop(_OLD_WORKERS_ENV, "").split(",") if pid]
+    if not old_workers:
+        # Fresh start: drop snapshots of a previous run (a reload keeps counting)
+        metrics.clear_snapshots()
+
+    ready_read, ready_write = os.pipe()
+    workers = {_spawn(sock, app, warm_up, ready_write) for _ in range(SERVE_WORKERS)}
+    os.close(ready_write)
+    if old_workers:
+        # Keep the previous generation serving while the new workers load models
+        ready = _wait_ready(ready_read, len(workers))
+        if ready < len(workers):
+            print(f"Only {ready} of {len(workers)} new workers are ready, stopping the old ones anyway")
+        # Let the previous generation drain and exit
+        _stop_workers(old_workers)
+        print(f"Reload complete, stopped {len(old_workers)} old workers")
+    os.close(ready_read)
+
+    state = {"reload": False, "stop": False}
+    signal.signal(signal.SIGHUP, lambda signum, frame: state.update(reload=True))
+    signal.signal(signal.SIGTERM, lambda signum, frame: state.update(stop=True))
+    signal.signal(signal.SIGINT, lambda signum, frame: state.update(stop=True))
+
+    while True:
+        if state["stop"]:
+            print("Shutting down workers")
+            _stop_workers(list(workers))
+            sock.close()
+            return
+        if state["reload"]:
+            print("Reloading: re-executing the master")
+            os.set_inheritable(sock.fileno(), True)
+            os.environ[_LISTEN_FD_ENV] = str(sock.fileno())
+            os.environ[_OLD_WORKERS_ENV] = ",".join(str(pid) for pid in workers)
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+
+        # Replace workers that died unexpectedly
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid and pid in workers:
+            workers.discard(pid)
+            print(f"Worker {pid} exited with status {status}, starting a replacement")
+            workers.add(_spawn(sock, app, warm_up))
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    from app import app, warm_up_models
+    run(app, warm_up_models)
@@ -0,0 +1,101 @@
+import os
+import re
+import pickle
+import tempfile
+import threading
+
+# Local directory holding state every worker process must see (job status and
+# results, async plot uploads). Prefork workers share one listening socket, so a
+# follow-up request can reach a different worker than the one that started the work.
+SHARED_STATE_DIR = os.environ.get("SHARED_STATE_DIR", os.path.join(tempfile.gettempdir(), "frag_shared_state"))
+
+# Record keys are ids from URLs; never let them name a path outside the store
+_KEY_PATTERN = re.compile(r"[A-Za-z0-9_.-]+")
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def pid_alive(pid):
+    """True if a process with this pid exists on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedStateStore:
+    """
+    Small picklable records on local disk, readable from every process.
+
+    Writes go to a temporary file that is renamed into place, so readers see
+    either the previous record or the new one, never a partial write.
+    """
+
+    def __init__(self, name, root=SHARED_STATE_DIR):
+        self.path = os.path.join(root, name)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, key):
+        if not _KEY_PATTERN.fullmatch(key) or key.startswith("."):
+            return None
+        return os.path.join(self.path, key)
+
+    def put(self, key, value):
+        path = self._file(key)
+        if path is None:
+            raise ValueError(f"Invalid state key '{key}'")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            # e.g. an unpicklable value: leave no partial file behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key, default=None):
+        path = self._file(key)
+        if path is None:
+            return default
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+
+    def delete(self, key):
+        path = self._file(key)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def keys(self, suffix=""):
+        """Record keys ending in `suffix`, oldest first."""
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(suffix) and not entry.name.endswith(".tmp"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.name))
+                except OSError:
+                    continue
+        return [name for _, name in sorted(entries)]
+
+
+def get_state_store(name):
+    """Return the process-wide store for `name`, creating its directory on first use."""
+    store = _stores.get(name)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(name)
+            if store is None:
+                store = SharedStateStore(name)
+                _stores[name] = store
+    return store
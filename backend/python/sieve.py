@@ -0,0 +1,74 @@
+import numpy as np
+
+# Standard sieve series used for fragmentation reports (same units as the measured sizes)
+DEFAULT_SIEVE_SERIES = [4000, 2000, 1000, 750, 500, 250, 125, 88, 63, 44, 32, 22, 16, 11, 7.8, 5.5, 4]
+
+
+class SieveCurve:
+    """
+    Cumulative passing curve of a set of fragment sizes.
+
+    Sizes are sorted once; every threshold or percentile query afterwards is a
+    binary search, so dense sieve series and large fragment counts stay cheap.
+    Passing percentages are by count unless per-fragment weights (e.g. area or
+    estimated mass) are given.
+    """
+
+    def __init__(self, sizes, weights=None):
+        sizes = np.asarray(sizes, dtype=np.float64).ravel()
+        order = np.argsort(sizes, kind="stable")
+        self.sizes = sizes[order]
+        if weights is None:
+            cumulative = np.arange(1, len(self.sizes) + 1, dtype=np.float64)
+        else:
+            weights = np.asarray(weights, dtype=np.float64).ravel()
+            if weights.shape != sizes.shape:
+                raise ValueError("weights must have one entry per size")
+            cumulative = np.cumsum(weights[order])
+        total = cumulative[-1] if len(cumulative) else 0.0
+        # Percentage passing at (and including) each sorted size
+        self.cumulative_percent = cumulative / total * 100 if total > 0 else np.zeros_like(cumulative)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def passing(self, thresholds):
+        """
+        Percentage of material with size <= each threshold.
+
+        Args:
+            thresholds: Scalar or array of sieve sizes
+
+        Returns:
+            Array (or scalar) of passing percentages in [0, 100]
+        """
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        if len(self.sizes) == 0:
+            return np.zeros_like(thresholds)
+        idx = np.searchsorted(self.sizes, thresholds, side="right")
+        padded = np.concatenate(([0.0], self.cumulative_percent))
+        return padded[idx]
+
+    def passing_by_sieve(self, sieve_series=None):
+        """
+        Passing percentage for every sieve of a series, keyed by the sieve size
+        formatted like "500" or "7.8", whether the size was given as int or float.
+        """
+        sieve_series = DEFAULT_SIEVE_SERIES if sieve_series is None else list(sieve_series)
+        values = self.passing(sieve_series)
+        return {f"{size:g}": float(value) for size, value in zip(sieve_series, values)}
+
+    def percentile(self, percent):
+        """
+        Size below which the given percentage of material passes (e.g. 50 -> P50),
+        interpolated linearly between measured sizes. Returns None without data.
+        """
+        if len(self.sizes) == 0:
+            return None
+        return float(np.interp(percent, self.cumulative_percent, self.sizes))
+
+    def percentiles(self, percents=(10, 50, 80)):
+        """
+        Several percentile sizes at once, keyed like "P10", "P50", "P80".
+        """
+        return {f"P{p:g}": self.percentile(p) for p in percents}
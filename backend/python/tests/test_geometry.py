@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import geometry
+from geometry import max_diameter, max_diameters
+
+
+def _brute_force_diameter(points):
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    diff = pts[:, None, :] - pts[None, :, :]
+    return float(np.sqrt((diff ** 2).sum(axis=2).max()))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_max_diameter_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    points = rng.integers(0, 500, size=(300, 1, 2))
+    distance, pt1, pt2 = max_diameter(points)
+    assert distance == pytest.approx(_brute_force_diameter(points))
+    # The reported endpoints realize the distance
+    assert np.hypot(pt1[0] - pt2[0], pt1[1] - pt2[1]) == pytest.approx(distance)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rotating_calipers_match_brute_force(seed, monkeypatch):
+    # Force the calipers path that large hulls take
+    monkeypatch.setattr(geometry, "_PAIRWISE_MAX_HULL", 0)
+    rng = np.random.default_rng(seed)
+    points = rng.integers(0, 500, size=(300, 2))
+    distance, pt1, pt2 = max_diameter(points)
+    assert distance == pytest.approx(_brute_force_diameter(points))
+    assert np.hypot(pt1[0] - pt2[0], pt1[1] - pt2[1]) == pytest.approx(distance)
+
+
+def test_degenerate_contours():
+    assert max_diameter(np.zeros((0, 2), dtype=np.int64)) == (0, None, None)
+    assert max_diameter(np.array([[3, 4]])) == (0, None, None)
+    distances, pt1s, pt2s = max_diameters([np.array([[[0, 0]], [[3, 4]]]), np.array([[[7, 7]]])])
+    assert distances.tolist() == [5.0, 0.0]
+    assert pt1s[1].tolist() == [-1, -1] and pt2s[1].tolist() == [-1, -1]
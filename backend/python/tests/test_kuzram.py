@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from kuzram import kuz_ram_batch, kuz_ram_model, rosin_rammler_curve
+
+DESIGNS = [
+    (5.955, 0.139, 66.725, 100, 1.851),
+    (7.0, 0.5, 120.0, 115, 1.2),
+    (10.0, 0.3, 40.0, 90, 2.4),
+]
+
+
+def _grid_kuz_ram(A, K, Q, E, n):
+    """The original scalar model: percentiles read off a 100-point size grid."""
+    X50 = A * Q**(0.17) * (115 / E)**(0.63) * K**(-0.8)
+    Xc = X50 / (0.693)**(1 / n)
+    sizes = np.linspace(1, 3 * X50, 100)
+    distribution = 100 * (1 - np.exp(-(sizes / Xc)**n))
+
+    def get_percentile(percentile):
+        indices = np.where(distribution >= percentile)[0]
+        return sizes[indices[0]] if len(indices) else None
+
+    below_60 = distribution[np.where(sizes <= 60)[0][-1]]
+    return X50, sizes[1] - sizes[0], {
+        "P10": get_percentile(10), "P20": get_percentile(20), "P80": get_percentile(80),
+        "P90": get_percentile(90), "TopSize": get_percentile(99),
+    }, below_60
+
+
+@pytest.mark.parametrize("design", DESIGNS)
+def test_closed_form_matches_grid_model(design):
+    X50, step, grid_percentiles, grid_below_60 = _grid_kuz_ram(*design)
+    result = kuz_ram_model(*design)
+    assert result["X50"] == pytest.approx(X50)
+    for key, grid_value in grid_percentiles.items():
+        if grid_value is None:
+            continue  # beyond the grid's 3 * X50 range
+        # The grid returns the first size at or above the exact percentile size
+        assert grid_value - step - 1e-9 <= result[key] <= grid_value + 1e-9
+    # The grid evaluates the curve at the last size <= 60, which passes no more
+    assert result["percentage_below_60"] >= grid_below_60 - 1e-9
+    assert result["percentage_below_60"] + result["percentage_above_60"] == pytest.approx(100)
+
+
+def test_percentile_sizes_invert_the_curve():
+    result = kuz_ram_batch(*DESIGNS[0], percentiles=(10, 50, 90))
+    for p in (10, 50, 90):
+        passing = rosin_rammler_curve(result["X50"], DESIGNS[0][4], [result[f"P{p}"]])
+        assert passing[0] == pytest.approx(p)
+
+
+def test_batch_matches_scalar_calls():
+    columns = np.array(DESIGNS).T
+    batch = kuz_ram_batch(*columns)
+    for index, design in enumerate(DESIGNS):
+        scalar = kuz_ram_model(*design)
+        assert batch["X50"][index] == pytest.approx(scalar["X50"])
+        assert batch["P80"][index] == pytest.approx(scalar["P80"])
+        assert batch["P99"][index] == pytest.approx(scalar["TopSize"])
+        assert batch["percentage_below_60"][index] == pytest.approx(scalar["percentage_below_60"])
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+import torch
+from segment_anything.utils.amg import mask_to_rle_pytorch, remove_small_regions as sam_remove_small_regions, rle_to_mask
+
+from mask_codec import CroppedMask, compact_masks, overlap_area, remove_small_regions, union_masks
+
+
+def _random_masks(seed, count=6, shape=(60, 80)):
+    rng = np.random.default_rng(seed)
+    masks = []
+    for _ in range(count):
+        mask = np.zeros(shape, dtype=bool)
+        y0, x0 = rng.integers(0, shape[0] - 5), rng.integers(0, shape[1] - 5)
+        h, w = rng.integers(1, shape[0] - y0), rng.integers(1, shape[1] - x0)
+        mask[y0:y0 + h, x0:x0 + w] = rng.random((h, w)) < 0.6
+        masks.append(mask)
+    return masks
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_from_rle_matches_rle_to_mask(seed):
+    masks = _random_masks(seed)
+    # Include an empty mask and one touching every border
+    masks.append(np.zeros_like(masks[0]))
+    masks.append(np.ones_like(masks[0]))
+    rles = mask_to_rle_pytorch(torch.from_numpy(np.stack(masks)))
+    for mask, rle in zip(masks, rles):
+        cropped = CroppedMask.from_rle(rle)
+        assert np.array_equal(cropped.to_full(), rle_to_mask(rle))
+        assert np.array_equal(cropped.to_full(), mask)
+        assert cropped.area == int(mask.sum())
+
+
+def test_crop_is_tight():
+    mask = np.zeros((50, 40), dtype=bool)
+    mask[10:20, 5:9] = True
+    mask[12, 30] = True
+    cropped = CroppedMask.from_full(mask)
+    assert cropped.bbox == (5, 10, 26, 10)
+    crop = cropped.mask
+    assert crop[0].any() and crop[-1].any() and crop[:, 0].any() and crop[:, -1].any()
+
+
+def test_overlap_and_union_match_full_masks():
+    masks = _random_masks(7)
+    cropped = [CroppedMask.from_full(mask) for mask in masks]
+    for a, ca in zip(masks, cropped):
+        for b, cb in zip(masks, cropped):
+            assert overlap_area(ca, cb) == int((a & b).sum())
+    merged = union_masks(cropped)
+    assert np.array_equal(merged.to_full(), np.logical_or.reduce(masks))
+
+
+def test_rescale_round_trip():
+    mask = np.zeros((40, 60), dtype=bool)
+    mask[8:24, 10:30] = True
+    up = CroppedMask.from_full(mask).rescale((80, 120))
+    assert up.bbox == (20, 16, 40, 32)
+    assert np.array_equal(up.rescale((40, 60)).to_full(), mask)
+
+
+def test_compact_masks_accepts_rle_and_arrays():
+    masks = _random_masks(3, count=2)
+    anns = [{"segmentation": rle} for rle in mask_to_rle_pytorch(torch.from_numpy(masks[0][None]))]
+    anns.append({"segmentation": masks[1]})
+    compact_masks(anns)
+    assert all(isinstance(ann["segmentation"], CroppedMask) for ann in anns)
+    assert np.array_equal(anns[0]["segmentation"].to_full(), masks[0])
+    assert np.array_equal(anns[1]["segmentation"].to_full(), masks[1])
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_remove_small_regions_matches_sam(seed):
+    rng = np.random.default_rng(seed)
+    shape, min_area = (60, 80), 6
+    for _ in range(4):
+        mask = np.zeros(shape, dtype=bool)
+        mask[5:55, 5:75] = rng.random((50, 70)) < 0.7
+        # SAM's own postprocessing on the full-resolution mask: holes, then islands
+        expected, _ = sam_remove_small_regions(mask, min_area, mode="holes")
+        expected, _ = sam_remove_small_regions(expected, min_area, mode="islands")
+        ann = {"segmentation": CroppedMask.from_full(mask)}
+        kept = remove_small_regions([ann], min_area, nms_thresh=0.7)
+        assert kept == [ann]
+        assert np.array_equal(ann["segmentation"].to_full(), expected)
+        assert ann["area"] == int(expected.sum())
+
+
+def test_remove_small_regions_prefers_unchanged_duplicates():
+    shape = (40, 40)
+    clean = np.zeros(shape, dtype=bool)
+    clean[10:30, 10:30] = True
+    speckled = clean.copy()
+    speckled[2, 2] = True
+    anns = [{"segmentation": CroppedMask.from_full(speckled), "id": "speckled"},
+            {"segmentation": CroppedMask.from_full(clean), "id": "clean"}]
+    kept = remove_small_regions(anns, 10, nms_thresh=0.7)
+    # Without its speckle the first mask duplicates the second, which is kept
+    assert [ann["id"] for ann in kept] == ["clean"]
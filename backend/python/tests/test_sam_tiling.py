@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+import pytest
+
+from mask_codec import compact_masks
+from sam_tiling import generate_tiled, merge_tile_masks, tile_boxes
+
+
+def _fake_generate(labels):
+    """Stand-in for SAM: one annotation per connected object of a label image."""
+    anns = []
+    for value in np.unique(labels):
+        if value == 0:
+            continue
+        count, components = cv2.connectedComponents((labels == value).astype(np.uint8))
+        for index in range(1, count):
+            anns.append({"segmentation": components == index, "predicted_iou": 0.9})
+    return anns
+
+
+def _disk_labels(seed, shape=(300, 420), count=25, max_radius=40):
+    rng = np.random.default_rng(seed)
+    labels = np.zeros(shape, dtype=np.int32)
+    for value in range(1, count + 1):
+        for _ in range(50):
+            radius = int(rng.integers(8, max_radius))
+            cy = int(rng.integers(radius, shape[0] - radius))
+            cx = int(rng.integers(radius, shape[1] - radius))
+            disk = np.zeros(shape, dtype=np.uint8)
+            cv2.circle(disk, (cx, cy), radius, 1, -1)
+            if not (labels[disk > 0]).any():
+                labels[disk > 0] = value
+                break
+    return labels
+
+
+def _mask_set(anns):
+    return sorted((tuple(ann["segmentation"].bbox), ann["segmentation"].to_full().tobytes()) for ann in anns)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_tiled_matches_untiled(seed):
+    # Objects are smaller than the overlap, so each one is whole in some tile
+    labels = _disk_labels(seed)
+    untiled = compact_masks(_fake_generate(labels))
+    tiled = generate_tiled(_fake_generate, labels, tile_size=160, overlap=96)
+    assert len(tiled) == len(untiled)
+    assert _mask_set(tiled) == _mask_set(untiled)
+
+
+def test_edge_cut_pieces_are_joined():
+    # One long object that no single tile contains
+    labels = np.zeros((100, 400), dtype=np.int32)
+    labels[40:60, 20:380] = 1
+    tiled = generate_tiled(_fake_generate, labels, tile_size=150, overlap=90)
+    assert len(tiled) == 1
+    assert np.array_equal(tiled[0]["segmentation"].to_full(), labels == 1)
+    assert tiled[0]["area"] == int((labels == 1).sum())
+
+
+def test_duplicates_keep_the_best_score():
+    mask = np.zeros((50, 50), dtype=bool)
+    mask[10:30, 10:30] = True
+    complete = compact_masks([{"segmentation": mask, "predicted_iou": 0.8},
+                              {"segmentation": mask.copy(), "predicted_iou": 0.95}])
+    merged = merge_tile_masks(complete, [])
+    assert len(merged) == 1 and merged[0]["predicted_iou"] == 0.95
+
+
+def test_tiles_cover_the_image():
+    boxes = tile_boxes(1000, 700, 256, 64)
+    covered = np.zeros((700, 1000), dtype=bool)
+    for x0, y0, x1, y1 in boxes:
+        assert x1 - x0 <= 256 and y1 - y0 <= 256
+        covered[y0:y1, x0:x1] = True
+    assert covered.all()
+
+
+def test_overlap_must_be_smaller_than_tile():
+    with pytest.raises(ValueError):
+        tile_boxes(1000, 700, 256, 256)
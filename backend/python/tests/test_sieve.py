@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from sieve import SieveCurve
+
+
+def test_percentile_matches_numpy():
+    sizes = np.random.default_rng(0).lognormal(mean=3, sigma=1, size=500)
+    curve = SieveCurve(sizes)
+    # Linear interpolation between the k/n plotting positions
+    for p in (1, 10, 25, 50, 80, 90, 99.5):
+        assert curve.percentile(p) == pytest.approx(np.percentile(sizes, p, method="interpolated_inverted_cdf"))
+
+
+def test_passing_matches_counting():
+    sizes = np.random.default_rng(1).integers(1, 100, size=300).astype(float)
+    curve = SieveCurve(sizes)
+    for threshold in (0, 1, 17, 50, 50.5, 99, 100):
+        assert curve.passing(threshold) == pytest.approx(100 * np.mean(sizes <= threshold))
+
+
+def test_weighted_passing_matches_weight_sums():
+    rng = np.random.default_rng(2)
+    sizes = rng.uniform(1, 50, size=200)
+    weights = rng.uniform(0, 10, size=200)
+    curve = SieveCurve(sizes, weights)
+    result = curve.passing_by_sieve([5, 20, 45])
+    for sieve, value in zip([5, 20, 45], result.values()):
+        assert value == pytest.approx(100 * weights[sizes <= sieve].sum() / weights.sum())
+
+
+def test_sieve_keys_match_for_default_and_custom_series():
+    curve = SieveCurve([3, 60, 600, 6000])
+    default = curve.passing_by_sieve()
+    # A custom series parsed from a form ("4000,500,7.8") arrives as floats
+    custom = curve.passing_by_sieve([4000.0, 500.0, 7.8])
+    assert list(custom) == ["4000", "500", "7.8"]
+    for key, value in custom.items():
+        assert default[key] == value
+
+
+def test_empty_curve():
+    curve = SieveCurve([])
+    assert len(curve) == 0
+    assert curve.percentile(50) is None
+    assert curve.passing_by_sieve([10, 5]) == {"10": 0.0, "5": 0.0}
+
+
+def test_weights_must_match_sizes():
+    with pytest.raises(ValueError):
+        SieveCurve([1, 2, 3], weights=[1, 2])
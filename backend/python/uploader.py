@@ -0,0 +1,116 @@
+import os
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import timed
+from shared_state import get_state_store, pid_alive
+
+# ASP.NET upload endpoint that stores plots and returns their public URL
+UPLOAD_URL = os.environ.get("PLOT_UPLOAD_URL", "http://localhost:5180/api/Upload/upload")
+
+
+class PlotUploader:
+    """
+    Uploads rendered plots to the ASP.NET backend over a pooled keep-alive session.
+
+    `upload` blocks until the URL is known. `upload_async` hands the upload to a
+    small thread pool and returns an id whose state can be polled with `status`,
+    so the analysis response does not wait on the upload round trip. Upload state
+    lives in the shared state store, so any worker process can report it.
+    """
+
+    def __init__(self, url=UPLOAD_URL, pool_size=8, retries=3, backoff_factor=0.3,
+                 timeout=(3.05, 30), max_workers=4, max_tracked=1000, store=None):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"POST"}),
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plot-upload")
+        self._store = store if store is not None else get_state_store("plot_uploads")
+        self._max_tracked = max_tracked
+
+    @timed("plot_upload")
+    def upload(self, data, filename="plot.png", content_type="image/png"):
+        """
+        Upload bytes and return the URL reported by the backend.
+        """
+        # Bytes (not a file object) so retries can resend the body
+        resp = self.session.post(
+            self.url,
+            files={"file": (filename, data, content_type)},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        return resp.json()["url"]
+
+    def upload_async(self, data, filename="plot.png", content_type="image/png"):
+        """
+        Start an upload in the background and return its id.
+        """
+        upload_id = str(uuid.uuid4())
+        self._store.put(upload_id, {"id": upload_id, "status": "pending", "url": None, "error": None,
+                                    "owner_pid": os.getpid()})
+        future = self._executor.submit(self.upload, data, filename, content_type)
+        future.add_done_callback(lambda f, upload_id=upload_id: self._on_done(upload_id, f))
+        return upload_id
+
+    def _on_done(self, upload_id, future):
+        state = {"id": upload_id, "status": "done", "url": None, "error": None, "owner_pid": os.getpid()}
+        error = future.exception()
+        if error is None:
+            state["url"] = future.result()
+        else:
+            state.update(status="failed", error=str(error))
+        self._store.put(upload_id, state)
+        # Forget the oldest uploads once too many are tracked
+        tracked = self._store.keys()
+        for oldest_id in tracked[:max(len(tracked) - self._max_tracked, 0)]:
+            self._store.delete(oldest_id)
+
+    def status(self, upload_id):
+        return read_upload_status(upload_id, self._store)
+
+
+def read_upload_status(upload_id, store=None):
+    """
+    Return {"id", "status", "url", "error"} for an async upload, or None if unknown.
+    status is one of "pending", "done" or "failed".
+
+    Reads only the shared state store, so any worker process can answer for an
+    upload started by another one.
+    """
+    store = store if store is not None else get_state_store("plot_uploads")
+    state = store.get(upload_id)
+    if state is None:
+        return None
+    if state["status"] == "pending" and not pid_alive(state["owner_pid"]):
+        state.update(status="failed", error="The worker uploading this plot exited")
+    return {key: state[key] for key in ("id", "status", "url", "error")}
+
+
+_uploader = None
+_uploader_lock = threading.Lock()
+
+
+def get_uploader():
+    """Return the process-wide plot uploader, creating it on first use."""
+    global _uploader
+    if _uploader is None:
+        with _uploader_lock:
+            if _uploader is None:
+                _uploader = PlotUploader()
+    return _uploader